@@ -0,0 +1,532 @@
+""" Benchmarks for the game engine. Runs without a window.
+
+Usage:
+python benchmark.py [benchmark name ...]
+
+Runs all benchmarks if no names are given.
+"""
+import sys
+import os
+import io
+import re
+import time
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+import numpy as np
+from pytmx import load_pygame
+
+import tilesets
+from tilesets import load_tiled_map
+
+import mapcache
+from collision import SpatialHash, CollisionWorld
+from combat import HitResolver, DamageableTypes
+from game import Game
+from gameobjects import GameMap, merge_tile_rects, compact_layer_data, bake_region
+from items import Arrow
+from projectiles import ProjectilePool, ARMING_FRAMES, LIFETIME_FRAMES
+import simulation as simulation_module
+import characters
+import spritecache
+from spritecache import FrameCache
+
+MAPS = ["map1.tmx", "villa1.tmx", "village_house_1.tmx"]
+
+
+def timed(func, repeats=5):
+    """ Run func a number of times and return the best time in seconds and
+    the return value of the last run.
+    """
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            result = func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def load_cold(filename):
+    """ Load a map from its Tiled file, bypassing the baked map cache. """
+    cache_folder = mapcache.CACHE_FOLDER
+    with tempfile.TemporaryDirectory() as folder:
+        mapcache.CACHE_FOLDER = folder
+        try:
+            return GameMap(filename)
+        finally:
+            mapcache.CACHE_FOLDER = cache_folder
+
+
+def bench_map_load():
+    """ Load time of the bundled maps from the Tiled files (cold) and from
+    the baked map cache (warm), and the time spent merging collision and
+    water tiles into hitbox rectangles.
+    """
+    print(f"{'map':>20s} | {'cold (ms)':>10s} | {'warm (ms)':>10s} | {'merge (ms)':>10s} | {'tiles':>6s} | {'rects':>6s}")
+    for filename in MAPS:
+        cold_time, game_map = timed(lambda: load_cold(filename), repeats=3)
+        warm_time, _ = timed(lambda: GameMap(filename), repeats=3)
+        solid = game_map._collision_object_matrix == 1
+        water = (game_map._water_matrix - game_map._bridge_matrix) == 1
+        merge_time, _ = timed(lambda: (merge_tile_rects(solid), merge_tile_rects(water)))
+        tiles = int(solid.sum() + water.sum())
+        rects = len(merge_tile_rects(solid)) + len(merge_tile_rects(water))
+        print(f"{filename:>20s} | {cold_time*1000:10.1f} | {warm_time*1000:10.1f} | {merge_time*1000:10.2f} | {tiles:6d} | {rects:6d}")
+
+
+def bench_bake():
+    """ Time spent parsing the bundled maps with pytmx, and baking all their
+    regions from the parsed tile layers.
+    """
+    print(f"{'map':>20s} | {'layers':>6s} | {'pytmx (ms)':>10s} | {'bake (ms)':>10s}")
+    for filename in MAPS:
+        path = os.path.join("map", filename)
+        parse_time, tmx_data = timed(lambda: load_tiled_map(path), repeats=3)
+        compact_layer_data(tmx_data)
+        game_map = GameMap.__new__(GameMap)
+        game_map._mapwidth_tiles = tmx_data.width
+        game_map._mapheight_tiles = tmx_data.height
+        regions = [game_map.region_tiles(key) for key in game_map.region_keys()]
+        bake_time, _ = timed(lambda: [bake_region(tmx_data, tiles) for tiles in regions])
+        print(f"{filename:>20s} | {len(tmx_data.layers):6d} | {parse_time*1000:10.1f} | {bake_time*1000:10.1f}")
+
+
+def resident_memory():
+    """ Resident memory of this process in MB (Linux only, else 0). """
+    try:
+        with open("/proc/self/statm") as infile:
+            return int(infile.read().split()[1])*os.sysconf("SC_PAGE_SIZE")/1e6
+    except OSError:
+        return 0
+
+
+def bench_tilesets(switches=2):
+    """ Parse the bundled maps one after the other, as when walking between
+    them, with pytmx' own image loader and with the shared tileset cache.
+    Reports the parse times and the pixel memory of all the tile images
+    while all parsed maps are alive, counting shared surfaces once.
+    """
+    route = MAPS*switches
+    print(f"{'loader':>10s} | " + " | ".join(f"{filename[:-4]:>15s}" for filename in route) + f" | {'tiles (MB)':>10s}")
+    for name, loader in (("pytmx", load_pygame), ("shared", load_tiled_map)):
+        tilesets.clear_tileset_cache()
+        loaded = []
+        times = []
+        for filename in route:
+            load_time, tmx_data = timed(lambda: loader(os.path.join("map", filename)), repeats=1)
+            loaded.append(tmx_data)
+            times.append(load_time)
+        surfaces = {}
+        for tmx_data in loaded:
+            for image in tmx_data.images:
+                while image is not None and image.get_parent() is not None:
+                    image = image.get_parent()
+                if image is not None:
+                    surfaces[id(image)] = image
+        memory = sum(surface.get_pitch()*surface.get_height() for surface in surfaces.values())/1e6
+        print(f"{name:>10s} | " + " | ".join(f"{load_time*1000:12.1f} ms" for load_time in times) + f" | {memory:10.1f}")
+
+
+def bench_static_collision(queries=2000):
+    """ Time of movement probes against an increasing number of static map
+    hitboxes, with a Rect.collidedict over all hitboxes and with the
+    SpatialHash.
+    """
+    rng = np.random.default_rng(1)
+    probes = [pygame.Rect(int(x), int(y), 24, 16) for x, y in rng.integers(0, 3200, (queries, 2))]
+    print(f"{'hitboxes':>8s} | {'collidedict (us)':>16s} | {'spatial hash (us)':>17s}")
+    for count in (100, 1000, 10000, 50000):
+        rects = {f"{n}cmapobj": pygame.Rect(int(x)*32, int(y)*32, int(w)*32, int(h)*32)
+                 for n, (x, y, w, h) in enumerate(zip(*rng.integers(0, 100, (2, count)), *rng.integers(1, 4, (2, count))))}
+        index = SpatialHash()
+        for name, rect in rects.items():
+            index.insert(name, rect)
+        dict_time, dict_hits = timed(lambda: [probe.collidedict(rects, 1) is not None for probe in probes], repeats=3)
+        hash_time, hash_hits = timed(lambda: [index.collides(probe) for probe in probes], repeats=3)
+        assert dict_hits == hash_hits
+        print(f"{count:8d} | {dict_time/queries*1e6:16.2f} | {hash_time/queries*1e6:17.2f}")
+
+
+def bench_batched_motion():
+    """ Time to resolve the movement of 1 to 500 NPCs against the map1.tmx
+    hitboxes and each other, one character at a time with
+    CollisionWorld.collides() and in one pass with CollisionWorld.move_batch().
+    """
+    with redirect_stdout(io.StringIO()):
+        static_hitboxes = GameMap("map1.tmx").static_hitboxes
+    rng = np.random.default_rng(1)
+    print(f"{'npcs':>5s} | {'sequential (ms)':>15s} | {'batched (ms)':>12s}")
+    for count in (1, 10, 50, 100, 200, 500):
+        entities = [object() for _ in range(count)]
+        hitboxes = [pygame.Rect(int(x), int(y), 24, 16) for x, y in rng.integers(0, 3200, (count, 2))]
+        movements = rng.integers(-2, 3, (count, 2)).astype(float)
+
+        def sequential():
+            world = CollisionWorld(static_hitboxes)
+            resolved = []
+            for entity, hitbox, (movement_x, movement_y) in zip(entities, hitboxes, movements):
+                if movement_x != 0 and world.collides(hitbox.move(movement_x + np.sign(movement_x), 0), ignore = entity):
+                    movement_x = 0
+                if movement_y != 0 and world.collides(hitbox.move(0, movement_y + np.sign(movement_y)), ignore = entity):
+                    movement_y = 0
+                world.update(entity, hitbox)
+                resolved.append((movement_x, movement_y))
+            return np.array(resolved, dtype=float)
+
+        def batched():
+            return CollisionWorld(static_hitboxes).move_batch(entities, hitboxes, movements)
+
+        sequential_time, sequential_result = timed(sequential)
+        batched_time, batched_result = timed(batched)
+        assert np.array_equal(sequential_result, batched_result)
+        print(f"{count:5d} | {sequential_time*1000:15.3f} | {batched_time*1000:12.3f}")
+
+
+def bench_hit_resolution(attacks=50):
+    """ Time to resolve a frame of arrow hits on map1.tmx with 10 to 500
+    characters, testing every arrow against every character and map hitbox,
+    and with the HitResolver, which tests all arrows in one vectorized pass.
+    """
+    class Target:
+        position = np.zeros(2)
+
+        def take_damage(self, damage):
+            pass
+
+    with redirect_stdout(io.StringIO()):
+        static_hitboxes = GameMap("map1.tmx").static_hitboxes
+    static = static_hitboxes.query(pygame.Rect(0, 0, 2**20, 2**20))
+    rng = np.random.default_rng(1)
+    projectiles = ProjectilePool(lambda image: [None]*4)
+    for x, y in rng.integers(0, 3200, (attacks, 2)):
+        projectiles.spawn(Arrow, int(x), int(y), 3)
+    for _ in range(ARMING_FRAMES + 1):
+        armed = projectiles.step()
+    print(f"{'characters':>10s} | {'all hitboxes (ms)':>17s} | {'resolver (ms)':>13s}")
+    for count in (10, 50, 100, 500):
+        world = CollisionWorld(static_hitboxes)
+        for x, y in rng.integers(0, 3200, (count, 2)):
+            world.update(Target(), pygame.Rect(int(x), int(y), 24, 32))
+
+        def all_hitboxes():
+            stopped = []
+            for slot in armed:
+                attack_rect = projectiles.hitbox(slot)
+                for target, hitbox in list(world.dynamic.items()) + static:
+                    if attack_rect.colliderect(hitbox):
+                        try:
+                            target.take_damage(projectiles.damage(slot))
+                            stopped.append(slot)
+                        except AttributeError:
+                            if not "wmapobj" in target:
+                                stopped.append(slot)
+            return stopped
+
+        resolver = HitResolver(world, lambda target, position: None, DamageableTypes([Target]))
+        all_time, all_stopped = timed(all_hitboxes, repeats=3)
+        resolver_time, resolver_stopped = timed(lambda: resolver.resolve_projectiles(projectiles, armed), repeats=3)
+        assert set(all_stopped) == set(resolver_stopped)
+        print(f"{count:10d} | {all_time*1000:17.3f} | {resolver_time*1000:13.3f}")
+
+
+def bench_projectiles(frames=400):
+    """ Per-frame cost of spawning, moving, expiring and collecting the
+    sprites of arrows, with one object and sprite per arrow in a list, and
+    with the ProjectilePool. Arrows live for LIFETIME_FRAMES frames, so
+    spawning k arrows a frame keeps about k*LIFETIME_FRAMES in flight.
+    """
+    layer = pygame.Surface((832, 256), pygame.SRCALPHA)
+    layer.fill((200, 150, 100, 255))
+
+    def make_frames(image):
+        frames = []
+        for direction in range(4):
+            surf = pygame.Surface((64, 64), pygame.SRCALPHA)
+            if direction != 0:
+                surf.blit(layer, (0, 0), (768, int(direction*64), 64, 64))
+            else:
+                surf.blit(layer, (0, 0), (768, 128, 64, 64))
+                surf = pygame.transform.flip(surf, 1, 1)
+            frames.append(surf)
+        return frames
+
+    print(f"{'per frame':>9s} | {'in flight':>9s} | {'list (ms)':>9s} | {'pool (ms)':>9s}")
+    for per_frame in (1, 5, 25):
+        def objects():
+            projectiles = []
+            for frame in range(frames):
+                for n in range(per_frame):
+                    direction = (frame + n) % 4
+                    arrow = Arrow(1600, 1600, direction)
+                    surf = pygame.Surface((64, 64), pygame.SRCALPHA)
+                    if direction != 0:
+                        surf.blit(layer, (0, 0), (768, int(direction*64), 64, 64))
+                    else:
+                        surf.blit(layer, (0, 0), (768, 128, 64, 64))
+                        surf = pygame.transform.flip(surf, 1, 1)
+                    projectiles.append([arrow, surf])
+                expired = []
+                for projectile in projectiles:
+                    projectile[0].step()
+                    if projectile[0].timer > LIFETIME_FRAMES:
+                        expired.append(projectile)
+                for projectile in expired:
+                    projectiles.remove(projectile)
+                sprites = [(surf, projectile.position - 32) for projectile, surf in projectiles]
+            return len(sprites)
+
+        def pool():
+            projectiles = ProjectilePool(make_frames)
+            for frame in range(frames):
+                for n in range(per_frame):
+                    projectiles.spawn(Arrow, 1600, 1600, (frame + n) % 4)
+                projectiles.step()
+                sprites = projectiles.sprites()
+            return len(sprites)
+
+        list_time, list_count = timed(objects, repeats=3)
+        pool_time, pool_count = timed(pool, repeats=3)
+        assert list_count == pool_count
+        print(f"{per_frame:9d} | {pool_count:9d} | {list_time/frames*1000:9.3f} | {pool_time/frames*1000:9.3f}")
+
+
+def quiet():
+    """ Hide the output of a worker process. """
+    sys.stdout = open(os.devnull, "w")
+
+
+def bench_headless(ticks=300, episodes=16):
+    """ Simulation speed without a window: ticks per second of one headless
+    game, and episodes per second when running them in a process pool.
+    """
+    script = [["right"]]*100 + [["down", "run"]]*100 + [["attack"]]*(ticks - 200)
+    with redirect_stdout(io.StringIO()):
+        simulation = simulation_module.Simulation(preload_maps = 0)
+
+    def episode():
+        simulation.reset()
+        for actions in script:
+            simulation.step(actions)
+
+    episode_time, _ = timed(episode, repeats=3)
+    print(f"one game: {ticks/episode_time:.0f} ticks/s")
+
+    print(f"{'processes':>9s} | {'episodes/s':>10s}")
+    for processes in (1, 2, 4):
+        with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"), initializer=quiet) as pool:
+            list(pool.map(simulation_module.run_episode, [[]]*processes)) # load the game in every process
+            start = time.perf_counter()
+            results = list(pool.map(simulation_module.run_episode, [script]*episodes))
+            elapsed = time.perf_counter() - start
+        assert all(len(observations) == ticks for observations in results)
+        print(f"{processes:9d} | {episodes/elapsed:10.1f}")
+
+
+def bench_replay(ticks=600):
+    """ Record a scripted session of the headless game to an input recording,
+    and replay it. Reports the simulation time per tick of the replay, and
+    checks that it ends in the same state as the recorded session.
+    """
+    script = [["right"]]*150 + [["attack"]]*50 + [["down", "run"]]*150 + [["left"]]*(ticks - 350)
+    with tempfile.TemporaryDirectory() as folder:
+        filename = os.path.join(folder, "session.rpgi")
+        with redirect_stdout(io.StringIO()):
+            game = Game(headless = True, preload_maps = 0, record_input = filename)
+            game.init_game()
+            for actions in script:
+                game.loop(simulation_module.KeyStates(actions))
+            game.cleanup()
+        recorded = (game.player.position.copy(), [npc.position.copy() for npc in game.npcs])
+        size = os.path.getsize(filename)
+
+        with redirect_stdout(io.StringIO()):
+            game = Game(headless = True, preload_maps = 0, replay_input = filename)
+            game.init_game()
+            start = time.perf_counter()
+            while game._running:
+                game.loop()
+            elapsed = time.perf_counter() - start
+    replayed = (game.player.position, [npc.position for npc in game.npcs])
+    assert np.array_equal(recorded[0], replayed[0]) and all(map(np.array_equal, recorded[1], replayed[1]))
+    print(f"{ticks} ticks, recording {size} bytes, replay {elapsed/ticks*1000:.2f} ms/tick")
+
+
+def bench_sprites(frames=60):
+    """ Per-frame cost of making the sprites and shadows of 10 to 200 walking
+    roman soldiers, cutting them from the merged animation sheets every frame
+    and with the shared frame and shadow caches.
+    """
+    with redirect_stdout(io.StringIO()):
+        game = Game(headless = True, preload_maps = 0)
+        game.init_game()
+    print(f"{'npcs':>5s} | {'uncached (ms)':>13s} | {'cached (ms)':>11s} | {'hit rate':>8s}")
+    for count in (10, 50, 100, 200):
+        soldiers = [game.make_roman_soldier(0, 0) for _ in range(count)]
+
+        def walk():
+            for frame in range(frames):
+                for soldier in soldiers:
+                    soldier.check_state()
+                    soldier.make_sprite(100)
+
+        times = {}
+        for max_frames in (0, 2048):
+            characters.frame_cache = FrameCache(max_frames)
+            characters.shadow_cache = FrameCache(max_frames)
+            characters.atlas_cache = FrameCache(max_frames)
+            for i, soldier in enumerate(soldiers):
+                soldier.set_state("walk")
+                soldier._facing = i % 4
+            times[max_frames], _ = timed(walk, repeats=3)
+        cache = characters.frame_cache
+        print(f"{count:5d} | {times[0]/frames*1000:13.3f} | {times[2048]/frames*1000:11.3f} | "
+              f"{cache.hits/(cache.hits + cache.misses):8.1%}")
+    characters.frame_cache = spritecache.frame_cache
+    characters.shadow_cache = spritecache.shadow_cache
+    characters.atlas_cache = spritecache.atlas_cache
+
+
+def bench_render(frames=200):
+    """ Time to draw a frame of map1.tmx with a few NPCs, with the player
+    standing still, with the player walking and the camera following, with
+    the player standing at dusk, in a crowd of 200 NPCs and in the inventory
+    screen. Drawing the whole screen every frame is compared to scrolling
+    the ground of the previous frame, and to also drawing only the parts
+    that changed. Only render() is timed. Also reports how many sprites are
+    culled outside the camera view.
+    """
+    configs = (("full", False, False), ("scrolled ground", False, True), ("dirty rects", True, True))
+    print(f"{'scene':>9s} | " + " | ".join(f"{name + ' (ms)':>20s}" for name, dirty_rects, scroll_ground in configs))
+    times = {}
+    for config, dirty_rects, scroll_ground in configs:
+        with redirect_stdout(io.StringIO()):
+            game = Game(headless = True, dirty_rects = dirty_rects, scroll_ground = scroll_ground, preload_maps = 0)
+            game.init_game()
+        game._messageboxes.clear()
+        game._day_time = 60
+        for i in range(4):
+            game.npcs.append(game.make_roman_soldier(500 + 60*i, 380))
+
+        def play(actions, repeats=3, start=None):
+            best = float("inf")
+            for repeat in range(repeats):
+                if start is not None:
+                    start()
+                render_time = 0
+                for frame in range(frames):
+                    game.loop(simulation_module.KeyStates(actions))
+                    render_start = time.perf_counter()
+                    game.render()
+                    render_time += time.perf_counter() - render_start
+                best = min(best, render_time)
+            return best
+
+        def walk_start():
+            game.player.set_pos(np.array([1500., 1200.]))
+            game._cam_x, game._cam_y = 640, 800
+
+        times["walking", config] = play(["right"], start = walk_start)
+        times["standing", config] = play([])
+        sprites = (game.drawn_sprites, game.culled_sprites)
+        game._day_time = 210
+        times["dusk", config] = play([])
+        game._day_time = 60
+        game.load_new_map("map1.tmx", (300, 300), (0, 0))
+        game.npcs = [game.make_roman_soldier(100. + 50*(i%20), 420. + 35*(i//20)) for i in range(200)]
+        times["crowd", config] = play([], repeats=1)
+        game.on_event(pygame.event.Event(pygame.KEYDOWN, key = pygame.K_TAB))
+        times["inventory", config], _ = timed(lambda: [game.render() for frame in range(frames)], repeats=3)
+    for scene in ("standing", "walking", "dusk", "crowd", "inventory"):
+        print(f"{scene:>9s} | " + " | ".join(f"{times[scene, config]/frames*1000:20.2f}" for config, dirty_rects, scroll_ground in configs))
+    print(f"sprites per frame when standing: {sprites[0]} drawn, {sprites[1]} culled")
+
+
+def make_large_map(filename, size):
+    """ Write a size x size tile map to the map folder by tiling the layers
+    of map1.tmx. Returns the path of the new file.
+    """
+    with open(os.path.join("map", "map1.tmx")) as infile:
+        tmx = infile.read()
+
+    def tile_layer(match):
+        grid = np.array([row.strip(",").split(",") for row in match.group(2).strip().splitlines()], dtype=int)
+        grid = np.tile(grid, (-(-size//grid.shape[0]), -(-size//grid.shape[1])))[:size, :size]
+        rows = ",\n".join(",".join(map(str, row)) for row in grid)
+        return f"{match.group(1)}\n{rows}\n{match.group(3)}"
+
+    tmx = re.sub(r'(<data encoding="csv">)(.*?)(</data>)', tile_layer, tmx, flags=re.S)
+    tmx = re.sub(r'(<(?:map|layer) [^>]*?)width="100" height="100"', rf'\1width="{size}" height="{size}"', tmx)
+    path = os.path.join("map", filename)
+    with open(path, "w") as outfile:
+        outfile.write(tmx)
+    return path
+
+
+def bench_streaming(size=500, frames=2000, speed=5):
+    """ Walk diagonally across a large streamed map and measure the per-frame
+    cost of streaming regions in and out and drawing the map layers, and the
+    resident memory along the way.
+    """
+    screen = pygame.display.set_mode((1280, 800))
+    path = make_large_map("_benchmark_large.tmx", size)
+    try:
+        memory_before = resident_memory()
+        load_time, game_map = timed(lambda: GameMap("_benchmark_large.tmx", streaming=True), repeats=1)
+    finally:
+        os.remove(path)
+    print(f"map: {size}x{size} tiles, load {load_time*1000:.0f} ms, "
+          f"memory {memory_before:.0f} MB -> {resident_memory():.0f} MB")
+
+    position = np.array([600.0, 400.0])
+    game_map.stream_regions(position, wait=True)
+    frame_times = []
+    memory = []
+    for frame in range(frames):
+        start = time.perf_counter()
+        game_map.stream_regions(position)
+        camera = pygame.Rect(position[0] - 640, position[1] - 400, 1280, 800)
+        screen.fill((0, 0, 0))
+        game_map.ground_layer.draw(screen, camera)
+        game_map.above_layer.draw(screen, camera)
+        frame_times.append(time.perf_counter() - start)
+        if frame % 100 == 0:
+            memory.append(resident_memory())
+        position += speed
+        position %= (size*32 - 800)
+    frame_times = np.array(frame_times)*1000
+    print(f"frame (ms): mean {frame_times.mean():.2f}, 99th percentile {np.percentile(frame_times, 99):.2f}, "
+          f"max {frame_times.max():.2f}")
+    print(f"resident memory (MB) while walking: min {min(memory):.0f}, max {max(memory):.0f}")
+    game_map.stop_streaming()
+
+
+benchmarks = {"map_load": bench_map_load,
+              "bake": bench_bake,
+              "tilesets": bench_tilesets,
+              "static_collision": bench_static_collision,
+              "batched_motion": bench_batched_motion,
+              "hit_resolution": bench_hit_resolution,
+              "projectiles": bench_projectiles,
+              "headless": bench_headless,
+              "replay": bench_replay,
+              "sprites": bench_sprites,
+              "render": bench_render,
+              "streaming": bench_streaming}
+
+
+if __name__ == "__main__":
+    pygame.init()
+    pygame.display.set_mode((1, 1))
+    names = sys.argv[1:] or list(benchmarks)
+    for name in names:
+        print(f"--- {name} ---")
+        benchmarks[name]()
@@ -1,13 +1,67 @@
-import time
-
 import numpy as np
 import pygame
 from pygame.locals import *
 
 from items import Weapon, Outfit, Ammo, Quiver, Extra_Item
+from simclock import clock
+from spritecache import frame_cache, shadow_cache, atlas_cache
 
 slm = np.logspace(0.3, -0.8, 20)*0.6 # shadow length modifiers
 
+
+def color_surface(surface, red, green, blue, alpha):
+    """ Color a pygame Surface in the given color.
+
+    Arguments:
+    surface -- the pygame Surface to color.
+    red -- red value to give the pixels.
+    green -- green value to give the pixels.
+    blue -- blue value to give the pixels.
+    alpha -- alpha value to give the pixels. Will be applied to all pixels
+             in the surface that do not have an alpha value of 0.
+    """
+    arr = pygame.surfarray.pixels3d(surface)
+    arr[:,:,0] = red
+    arr[:,:,1] = green
+    arr[:,:,2] = blue
+
+    alphas = pygame.surfarray.pixels_alpha(surface)
+    alphas[alphas != 0] = alpha
+
+
+def cast_shadow(frame, shadow_state, length_modifier = 1, alpha_modifier = 1):
+    """ Make the shadow of a sprite frame. See 'shadow_of()'. """
+    size = frame.get_width()
+    if shadow_state < 20:
+        shadow = pygame.transform.flip(pygame.transform.scale(frame, (size, int(size*slm[shadow_state]*length_modifier))), 0, 1)
+    elif shadow_state < 40:
+        shadow = pygame.transform.scale(frame, (size, int(size*slm[19 - shadow_state]/2*length_modifier)))
+    else:
+        return pygame.Surface((size, 1), pygame.SRCALPHA) # no shadows at night
+    color_surface(shadow, 50, 50, 50, (150 - 6*abs(20 - shadow_state))*alpha_modifier)
+    return shadow
+
+
+def shadow_of(frame, shadow_state, length_modifier = 1, alpha_modifier = 1):
+    """ The shadow of a sprite frame, from the shared spritecache.shadow_cache.
+    The shadow must not be drawn on.
+
+    Arguments:
+    frame -- the sprite frame casting the shadow.
+    shadow_state -- time of day as day_time//5. Shadows are cast towards the
+                    bottom of the screen before 20, towards the top until 40
+                    and not at all after.
+
+    Keyword arguments:
+    length_modifier -- factor on the length of the shadow (default 1)
+    alpha_modifier -- factor on the opacity of the shadow (default 1)
+    """
+    if shadow_state >= 40:
+        key = (frame.get_width(), 40)
+    else:
+        key = (frame, shadow_state, length_modifier, alpha_modifier)
+    return shadow_cache.get(key, lambda: cast_shadow(frame, shadow_state, length_modifier, alpha_modifier))
+
 class Character:
     """ Superclass for all characters """
     def __init__(self, x, y,
@@ -61,6 +115,8 @@ class Character:
         self._hair = [self.walkcycle[1]]
         self._outfit_anim = starting_outfit.walkcycle
         self._weapon_anim = []
+        self._layers = []
+        self._atlas = None # all layers of the current animation in one sheet
 
         self._facing = 3 # 0: up, 1: left, 2: down, 3: right
         self._position = np.array([x, y])
@@ -71,7 +127,6 @@ class Character:
         self._stamina = 200
         self._maxstamina = self._stamina
         self._shadow = None
-        self._prev_shadow_state = None
         self._shadowlength_modifier = 1
         self._time_since_sprinting = 0
         self.can_move = True
@@ -122,6 +177,7 @@ class Character:
             for k, item in self._inventory.items():
                 if item == key and isinstance(item, Weapon):
                     self._equipped_weapon = self._inventory[k]
+        self._atlas = None
 
     def equip_ammo(self, key):
         """ Equip an ammunition type from the characters inventory.
@@ -139,9 +195,11 @@ class Character:
             for k, item in self._inventory.items():
                 if item == key and isinstance(item, Ammo):
                     self._equipped_ammo = self._inventory[k]
+        self._atlas = None
 
     def unequip_ammo(self):
         self._equipped_ammo = None
+        self._atlas = None
 
     def add_to_inventory(self, item):
         """ Add an item to the characters inventory. 
@@ -226,11 +284,13 @@ class Character:
                 self._behind_anim = self.behind.bow
             elif self._state == "dead":
                 self._behind_anim = self.behind.hurt
+            self._atlas = None
 
     def remove_extra_item(self):
         """ Remove the 'Extra item' from the character if it has one equipped. """
         self.behind = None
         self._behind_anim = []
+        self._atlas = None
 
     def get_weapon_hit_rect(self):
         """ Create and return the pygame rect that is the hitbox from the currently equipped
@@ -316,6 +376,7 @@ class Character:
             if self.behind is not None:
                 self._behind_anim = self.behind.hurt
         self._anim_step = 0
+        self._atlas = None
 
     def set_pos(self, pos):
         """ Set the player position. Stores it as a Numpy array.
@@ -356,13 +417,7 @@ class Character:
         alpha -- alpha value to give the pixels. Will be applied to all pixels
                  in the surface that do not have an alpha value of 0.
         """
-        arr = pygame.surfarray.pixels3d(surface)
-        arr[:,:,0] = red
-        arr[:,:,1] = green
-        arr[:,:,2] = blue
-
-        alphas = pygame.surfarray.pixels_alpha(surface)
-        alphas[alphas != 0] = alpha
+        color_surface(surface, red, green, blue, alpha)
 
 
     """ Step forwards methods """
@@ -430,46 +485,59 @@ class Character:
         movement = np.zeros(2)
         return movement
 
-    def make_sprite(self, day_time):
-        """ Takes the current state of the character and creates and returns the
-        sprite, hitbox and shadow.
+    def bake_atlas(self):
+        """ Merge the body, hair, outfit, weapon and extra item sheets of the
+        current animation into one sheet. Runs on the first frame after the
+        state or the equipment changes. Characters with the same layers share
+        the sheet through spritecache.atlas_cache.
         """
-        sprite_y = int(self._facing*self._sprite_size)
-        sprite_x = int(self._anim_step)*self._sprite_size
-
-        self._layers = self._behind_anim + self._body + self._outfit_anim 
+        self._layers = self._behind_anim + self._body + self._outfit_anim
         if not self._outfit.has_hood:
             self._layers += self._hair
         self._layers += self._weapon_anim
         if self.equipped_ammo is not None and self._state == "bow":
             self._layers += self.equipped_ammo.anim_image
 
+        def merge_layers():
+            width = max(layer.get_width() for layer in self._layers)
+            height = max(layer.get_height() for layer in self._layers)
+            atlas = pygame.Surface((width, height), pygame.SRCALPHA)
+            for layer in self._layers:
+                atlas.blit(layer, (0, 0))
+            return atlas
+
+        self._atlas = atlas_cache.get(tuple(self._layers), merge_layers)
+
+    def cut_frame(self, sprite_x, sprite_y):
+        """ Copy one frame out of the current animation sheet.
+
+        Arguments:
+        sprite_x -- x-position of the frame in the sheet.
+        sprite_y -- y-position of the frame in the sheet.
+        """
         char_surf = pygame.Surface((self._sprite_size, self._sprite_size), pygame.SRCALPHA)
-        for layer in self._layers:
-            char_surf.blit(layer, (0, 0),
-                           (sprite_x, sprite_y, self._sprite_size, self._sprite_size))            
-        
+        char_surf.blit(self._atlas, (0, 0), (sprite_x, sprite_y, self._sprite_size, self._sprite_size))
+        return char_surf
+
+    def make_sprite(self, day_time):
+        """ Takes the current state of the character and creates and returns the
+        sprite, hitbox and shadow. Composited frames are shared through
+        spritecache.frame_cache, so the returned sprite must not be drawn on.
+        """
+        sprite_y = int(self._facing*self._sprite_size)
+        sprite_x = int(self._anim_step)*self._sprite_size
+
+        if self._atlas is None:
+            self.bake_atlas()
+        char_surf = frame_cache.get((self._atlas, sprite_x, sprite_y), lambda: self.cut_frame(sprite_x, sprite_y))
+
         hitbox = pygame.Rect(self._position[0] - 12, self._position[1] + 1, 24, 28)
 
         if self._state == "dead":
             hitbox = pygame.Rect((-1000, -1000, 1, 1))
 
         shadow_state = int(day_time//5)
-
-        if self._shadow == None or self._state != "idle" or shadow_state != self._prev_shadow_state or self._anim_step == 0:
-            if shadow_state < 20:
-                self._shadow = pygame.transform.flip(pygame.transform.scale(char_surf, (self._sprite_size, int(self._sprite_size*slm[shadow_state]*self._shadowlength_modifier))), 0, 1)
-            elif shadow_state < 40:
-                self._shadow = pygame.transform.scale(char_surf, (self._sprite_size, int(self._sprite_size*slm[19 - shadow_state]/2*self._shadowlength_modifier)))
-            
-            if shadow_state >= 40:
-                alpha_modifier = 0
-            else:
-                alpha_modifier = 1.5
-
-            self.color_surface(self._shadow, 50, 50, 50, (150 - 6*abs(20 - shadow_state))*alpha_modifier)
-
-        self._prev_shadow_state = shadow_state
+        self._shadow = shadow_of(char_surf, shadow_state, self._shadowlength_modifier, 1.5)
 
         return char_surf, hitbox
 
@@ -545,7 +613,7 @@ class NPC(Character):
                         
         self._y_shift = 0
         self._healthbar = None
-        self._last_facing_change = time.time() - 0.3
+        self._last_facing_change = float("-inf")
         self._last_hit_timer = 60
         self.status = "passive"
 
@@ -571,34 +639,34 @@ class NPC(Character):
             else:
                 self.attack()
 
-            now_time = time.time()
+            now_time = clock.time()
 
             if movement[1] < -0.5:
                 # up
                 if now_time - self._last_facing_change > 0.3:
                     self._facing = 0
-                    self._last_facing_change = time.time()
+                    self._last_facing_change = now_time
                 if self._state == "idle":
                     self.set_state("walk")
             elif movement[0] < -0.5:
                 # left
                 if now_time - self._last_facing_change > 0.3:
                     self._facing = 1
-                    self._last_facing_change = time.time()
+                    self._last_facing_change = now_time
                 if self._state == "idle":
                     self.set_state("walk")
             elif movement[1] > 0.5:
                 # down
                 if now_time - self._last_facing_change > 0.3:
                     self._facing = 2
-                    self._last_facing_change = time.time()
+                    self._last_facing_change = now_time
                 if self._state == "idle":
                     self.set_state("walk")
             elif movement[0] > 0.5:
                 # right
                 if now_time - self._last_facing_change > 0.3:
                     self._facing = 3
-                    self._last_facing_change = time.time()
+                    self._last_facing_change = now_time
                 if self._state == "idle":
                     self.set_state("walk")
             else:
@@ -754,7 +822,6 @@ class Combat_Dummy:
         self._shadow = None
         self._healthbar = None
         self._last_hit_timer = 60
-        self._prev_shadow_state = None
         self.can_move = False
 
     def take_damage(self, damage):
@@ -785,9 +852,7 @@ class Combat_Dummy:
         sprite_y = 0
         sprite_x = int(self._anim_step)*self._sprite_size
 
-        character_surf = pygame.Surface((self._sprite_size, self._sprite_size), pygame.SRCALPHA)
-
-        character_surf.blit(images, (0, 0), (sprite_x, sprite_y, self._sprite_size, self._sprite_size))
+        character_surf = frame_cache.get((images, sprite_x, sprite_y), lambda: self.cut_frame(images, sprite_x, sprite_y))
 
         if self._last_hit_timer < 60:
             self._last_hit_timer += 1
@@ -798,34 +863,28 @@ class Combat_Dummy:
             self._healthbar = None
         
         shadow_state = int(day_time//5)
-
-        if self._shadow == None or (self._state != "idle" and (self._state != "dead" or self._anim_step != 5)) or shadow_state != self._prev_shadow_state:
-            if shadow_state < 20:
-                self._shadow = pygame.transform.flip(pygame.transform.scale(character_surf, (self._sprite_size, int(self._sprite_size*slm[shadow_state]))), 0, 1)
-            elif shadow_state < 40:
-                self._shadow = pygame.transform.scale(character_surf, (self._sprite_size, int(self._sprite_size*slm[19 - shadow_state]/2)))
-            
-            if shadow_state >= 40:
-                alpha_modifier = 0
-            else:
-                alpha_modifier = 1
-
-            self.color_surface(self._shadow, 50, 50, 50, (150 - 6*abs(20 - shadow_state))*alpha_modifier)
-
-        self._prev_shadow_state = shadow_state
+        self._shadow = shadow_of(character_surf, shadow_state)
 
         return self._position, character_surf, [None, None], self._hitbox, np.zeros(2), self._shadow, self._y_shift, self._healthbar
 
-    def color_surface(self, surface, red, green, blue, alpha):
-        arr = pygame.surfarray.pixels3d(surface)
-        arr[:,:,0] = red
-        arr[:,:,1] = green
-        arr[:,:,2] = blue
+    def cut_frame(self, images, sprite_x, sprite_y):
+        """ Copy one frame out of an animation sheet. """
+        character_surf = pygame.Surface((self._sprite_size, self._sprite_size), pygame.SRCALPHA)
+        character_surf.blit(images, (0, 0), (sprite_x, sprite_y, self._sprite_size, self._sprite_size))
+        return character_surf
 
-        alphas = pygame.surfarray.pixels_alpha(surface)
-        alphas[alphas != 0] = alpha
+    def color_surface(self, surface, red, green, blue, alpha):
+        color_surface(surface, red, green, blue, alpha)
 
 
     @property
     def position(self):
-        return self._position
\ No newline at end of file
+        return self._position
+
+    @property
+    def health(self):
+        return self._health
+
+    @property
+    def maxhealth(self):
+        return self._maxhealth
@@ -0,0 +1,345 @@
+import pygame
+import numpy as np
+
+WALL = "wall" # static hitbox kinds
+WATER = "water"
+
+
+class SpatialHash:
+    """ Uniform grid of buckets for static hitboxes. Every hitbox is stored in
+    each grid cell it overlaps, so a query only tests the hitboxes in the cells
+    around the queried rect instead of every hitbox on the map.
+    """
+    def __init__(self, cell_size = 128):
+        """ Keyword arguments:
+        cell_size -- width and height of the grid cells in pixels (default 128)
+        """
+        self._cell_size = cell_size
+        self._cells = {} # (column, row) -> {key: rect}
+        self._rects = {} # key -> rect
+        self._kinds = {} # key -> kind
+        self._boxes = {} # kind -> (N, 4) array of the rects, built when needed
+
+    def cells(self, rect):
+        """ Keys (column, row) of the grid cells a rect overlaps. """
+        size = self._cell_size
+        for row in range(rect.top//size, (rect.top + max(rect.height, 1) - 1)//size + 1):
+            for column in range(rect.left//size, (rect.left + max(rect.width, 1) - 1)//size + 1):
+                yield (column, row)
+
+    def insert(self, key, rect, kind = WALL):
+        """ Add a hitbox. A hitbox already stored with the same key is replaced.
+
+        Keyword arguments:
+        kind -- what the hitbox is, WALL or WATER (default WALL)
+        """
+        if key in self._rects:
+            self.remove(key)
+        self._rects[key] = rect
+        self._kinds[key] = kind
+        self._boxes = {}
+        for cell in self.cells(rect):
+            self._cells.setdefault(cell, {})[key] = rect
+
+    def remove(self, key):
+        """ Remove a hitbox. Does nothing if the key is not stored. """
+        rect = self._rects.pop(key, None)
+        if rect is None:
+            return
+        del self._kinds[key]
+        self._boxes = {}
+        for cell in self.cells(rect):
+            bucket = self._cells[cell]
+            del bucket[key]
+            if not bucket:
+                del self._cells[cell]
+
+    def query(self, rect, kind = None):
+        """ Find the hitboxes colliding with a rect.
+
+        Keyword arguments:
+        kind -- only find hitboxes of this kind. None for all (default None)
+
+        Returns:
+        hits -- list of (key, rect), each hitbox at most once.
+        """
+        hits = {}
+        kinds = self._kinds
+        for cell in self.cells(rect):
+            bucket = self._cells.get(cell)
+            if bucket is None:
+                continue
+            for key, hitbox in bucket.items():
+                if key not in hits and rect.colliderect(hitbox) and (kind is None or kinds[key] == kind):
+                    hits[key] = hitbox
+        return list(hits.items())
+
+    def collides(self, rect):
+        """ Whether any hitbox collides with a rect. """
+        size = self._cell_size
+        cells = self._cells
+        for row in range(rect.top//size, (rect.top + max(rect.height, 1) - 1)//size + 1):
+            for column in range(rect.left//size, (rect.left + max(rect.width, 1) - 1)//size + 1):
+                bucket = cells.get((column, row))
+                if bucket is not None and rect.collidedict(bucket, 1) is not None:
+                    return True
+        return False
+
+    def boxes(self, kind = None):
+        """ All hitboxes as an (N, 4) array of x, y, width, height.
+
+        Keyword arguments:
+        kind -- only the hitboxes of this kind. None for all (default None)
+        """
+        boxes = self._boxes.get(kind)
+        if boxes is None:
+            boxes = np.array([tuple(rect) for key, rect in self._rects.items()
+                              if kind is None or self._kinds[key] == kind], dtype=np.int64).reshape(-1, 4)
+            self._boxes[kind] = boxes
+        return boxes
+
+    def __len__(self):
+        return len(self._rects)
+
+    def __contains__(self, key):
+        return key in self._rects
+
+    @property
+    def cell_size(self):
+        return self._cell_size
+
+
+BROADPHASE_MIN_PAIRS = 256*256 # use the grid broadphase when there are more probe-box pairs than this
+BROADPHASE_CELL_SIZE = 64
+
+
+def box_cells(boxes, cell_size):
+    """ The grid cells each box overlaps.
+
+    Arguments:
+    boxes -- (N, 4) array of x, y, width, height.
+    cell_size -- width and height of the grid cells.
+
+    Returns:
+    index -- array of box indices, one entry per overlapped cell.
+    cells -- array of cell ids, one entry per overlapped cell.
+    """
+    x0 = boxes[:, 0]//cell_size
+    y0 = boxes[:, 1]//cell_size
+    columns = (boxes[:, 0] + np.maximum(boxes[:, 2], 1) - 1)//cell_size - x0 + 1
+    rows = (boxes[:, 1] + np.maximum(boxes[:, 3], 1) - 1)//cell_size - y0 + 1
+    counts = columns*rows
+    index = np.repeat(np.arange(len(boxes)), counts)
+    k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    cell_x = x0[index] + k % columns[index]
+    cell_y = y0[index] + k//columns[index]
+    return index, (cell_x + 2**20)*2**21 + (cell_y + 2**20)
+
+
+def candidate_pairs(probes, boxes, cell_size = BROADPHASE_CELL_SIZE):
+    """ Pairs of probes and boxes that share a grid cell. A pair can appear
+    more than once.
+
+    Returns:
+    probe_index -- array of probe indices.
+    box_index -- array of box indices.
+    """
+    probe_index, probe_cells = box_cells(probes, cell_size)
+    box_index, box_cells_ = box_cells(boxes, cell_size)
+    order = np.argsort(box_cells_, kind="stable")
+    box_cells_ = box_cells_[order]
+    box_index = box_index[order]
+    first = np.searchsorted(box_cells_, probe_cells, "left")
+    counts = np.searchsorted(box_cells_, probe_cells, "right") - first
+    k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(probe_index, counts), box_index[np.repeat(first, counts) + k]
+
+
+def overlapping(probes, boxes, mask = None):
+    """ Which probes overlap any of the boxes, with the same rule as
+    pygame.Rect.colliderect. Many probes against many boxes are first paired
+    up with a grid broadphase.
+
+    Arguments:
+    probes -- (N, 4) array of x, y, width, height.
+    boxes -- (M, 4) array of x, y, width, height.
+
+    Keyword arguments:
+    mask -- (N, M) boolean array of which boxes each probe is tested against.
+            None tests all boxes (default None)
+
+    Returns:
+    hits -- (N,) boolean array.
+    """
+    if len(probes) == 0 or len(boxes) == 0:
+        return np.zeros(len(probes), dtype=bool)
+    if len(probes)*len(boxes) <= BROADPHASE_MIN_PAIRS:
+        px, py, pw, ph = (probes[:, n, None] for n in range(4))
+        bx, by, bw, bh = (boxes[None, :, n] for n in range(4))
+        hits = ((px < bx + bw) & (px + pw > bx) & (py < by + bh) & (py + ph > by)
+                & (pw != 0) & (ph != 0) & (bw != 0) & (bh != 0))
+        if mask is not None:
+            hits &= mask
+        return hits.any(axis=1)
+
+    probe_index, box_index = candidate_pairs(probes, boxes)
+    p = probes[probe_index]
+    b = boxes[box_index]
+    hits = ((p[:, 0] < b[:, 0] + b[:, 2]) & (p[:, 0] + p[:, 2] > b[:, 0])
+            & (p[:, 1] < b[:, 1] + b[:, 3]) & (p[:, 1] + p[:, 3] > b[:, 1])
+            & (p[:, 2] != 0) & (p[:, 3] != 0) & (b[:, 2] != 0) & (b[:, 3] != 0))
+    if mask is not None:
+        hits &= mask[probe_index, box_index]
+    result = np.zeros(len(probes), dtype=bool)
+    result[probe_index[hits]] = True
+    return result
+
+
+def resolve_moves(hitboxes, movements, static_boxes, dynamic_boxes = None, dynamic_mask = None):
+    """ Resolve the moves of many characters in one vectorized pass, with the
+    axis blocking rule used for a single character: an axis is blocked when
+    the hitbox moved along it by the movement plus one pixel collides with
+    something. Both axes are probed from the unmoved hitbox.
+
+    Arguments:
+    hitboxes -- (N, 4) array of the characters' hitboxes.
+    movements -- (N, 2) array of the proposed movements.
+    static_boxes -- (S, 4) array of boxes every character collides with.
+
+    Keyword arguments:
+    dynamic_boxes -- (M, 4) array of boxes tested according to 'dynamic_mask'
+                     (default None)
+    dynamic_mask -- (N, M) boolean array of which dynamic boxes each character
+                    collides with. None for all (default None)
+
+    Returns:
+    movements -- (N, 2) array of the movements with blocked axes set to 0.
+    """
+    hitboxes = np.asarray(hitboxes, dtype=np.int64).reshape(-1, 4)
+    movements = np.asarray(movements, dtype=np.float64).reshape(-1, 2)
+    resolved = movements.copy()
+    for axis in (0, 1):
+        step = movements[:, axis]
+        moving = step != 0
+        probes = hitboxes.copy()
+        probes[:, axis] += np.trunc(step + np.sign(step)).astype(np.int64) # pygame.Rect.move truncates
+        blocked = overlapping(probes, static_boxes)
+        if dynamic_boxes is not None:
+            blocked |= overlapping(probes, dynamic_boxes, dynamic_mask)
+        resolved[moving & blocked, axis] = 0
+    return resolved
+
+
+class CollisionWorld:
+    """ Everything characters can collide with. The static layer is the map's
+    SpatialHash, built once per map. The dynamic layer holds the hitboxes of
+    characters and is updated in place as they move.
+
+    Queries take an 'ignore' entity, usually the character that is moving,
+    so no filtered copies of the hitboxes are needed.
+    """
+    def __init__(self, static_hitboxes = None):
+        """ Keyword arguments:
+        static_hitboxes -- SpatialHash with the map hitboxes (default None,
+                           no static hitboxes)
+        """
+        self._static = static_hitboxes if static_hitboxes is not None else SpatialHash()
+        self._dynamic = {} # entity -> hitbox
+
+    def set_static(self, static_hitboxes):
+        """ Use the static hitboxes of another map. """
+        self._static = static_hitboxes
+
+    def update(self, entity, hitbox):
+        """ Add a dynamic hitbox, or move the one an entity already has. """
+        self._dynamic[entity] = hitbox
+
+    def remove(self, entity):
+        """ Remove the dynamic hitbox of an entity, if it has one. """
+        self._dynamic.pop(entity, None)
+
+    def clear_dynamic(self):
+        """ Remove all dynamic hitboxes. """
+        self._dynamic.clear()
+
+    def hitbox(self, entity):
+        """ The dynamic hitbox of an entity. """
+        return self._dynamic[entity]
+
+    def collides(self, rect, ignore = None):
+        """ Whether a rect collides with any static hitbox, or with a dynamic
+        hitbox of an entity other than 'ignore'.
+        """
+        if self._static.collides(rect):
+            return True
+        return self.collides_dynamic(rect, ignore)
+
+    def collides_dynamic(self, rect, ignore = None):
+        """ Whether a rect collides with the dynamic hitbox of an entity other
+        than 'ignore'.
+        """
+        hits = rect.collidedictall(self._dynamic, 1)
+        return len(hits) > 1 or (len(hits) == 1 and hits[0][0] is not ignore)
+
+    def move_batch(self, entities, hitboxes, movements):
+        """ Resolve the moves of several entities with 'resolve_moves()' and add
+        their hitboxes to the dynamic layer. Gives the same result as testing
+        each entity in order with 'collides()' and then adding its hitbox: an
+        entity collides with the hitboxes already in the dynamic layer and with
+        the entities before it in the batch.
+
+        Arguments:
+        entities -- list of the moving entities.
+        hitboxes -- list of their hitboxes before moving.
+        movements -- (N, 2) array of the proposed movements.
+
+        Returns:
+        movements -- (N, 2) array of the movements with blocked axes set to 0.
+        """
+        if len(entities) == 0:
+            return np.zeros((0, 2))
+        batch = set(entities)
+        existing = [tuple(hitbox) for entity, hitbox in self._dynamic.items() if entity not in batch]
+        boxes = np.array(existing + [tuple(hitbox) for hitbox in hitboxes], dtype=np.int64).reshape(-1, 4)
+        count = len(entities)
+        mask = np.ones((count, len(boxes)), dtype=bool)
+        mask[:, len(existing):] = np.tri(count, count, -1, dtype=bool)
+        resolved = resolve_moves(boxes[len(existing):], movements, self._static.boxes(), boxes, mask)
+        for entity, hitbox in zip(entities, hitboxes):
+            self._dynamic[entity] = hitbox
+        return resolved
+
+    def dynamic_boxes(self):
+        """ The dynamic hitboxes as an (N, 4) array of x, y, width, height, in
+        the order they were added.
+        """
+        return np.array([tuple(hitbox) for hitbox in self._dynamic.values()], dtype=np.int64).reshape(-1, 4)
+
+    def query_dynamic(self, rect, ignore = None):
+        """ Dynamic hitboxes colliding with a rect.
+
+        Returns:
+        hits -- list of (entity, hitbox), in the order they were added.
+        """
+        return [(entity, hitbox) for entity, hitbox in rect.collidedictall(self._dynamic, 1)
+                if entity is not ignore]
+
+    def query_static(self, rect, kind = None):
+        """ Static hitboxes colliding with a rect, as a list of (name, hitbox).
+        'kind' limits the search to WALL or WATER hitboxes.
+        """
+        return self._static.query(rect, kind)
+
+    def __contains__(self, entity):
+        return entity in self._dynamic
+
+    @property
+    def dynamic(self):
+        """ Dictionary of entity -> hitbox. Do not modify, use 'update()' and
+        'remove()'.
+        """
+        return self._dynamic
+
+    @property
+    def static(self):
+        return self._static
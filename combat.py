@@ -0,0 +1,92 @@
+from collision import WALL, overlapping
+
+
+class DamageableTypes:
+    """ Registry of the entity types that can take damage. An entity is
+    damageable if its class, or any class it inherits from, is registered.
+
+    Supports 'entity in damageable_types'.
+    """
+    def __init__(self, types = ()):
+        """ Keyword arguments:
+        types -- classes to register (default none)
+        """
+        self._types = set(types)
+        self._lookup = {} # class -> whether it is damageable
+
+    def register(self, entity_type):
+        """ Make instances of a class, and of its subclasses, damageable. """
+        self._types.add(entity_type)
+        self._lookup.clear()
+
+    def __contains__(self, entity):
+        entity_type = type(entity)
+        damageable = self._lookup.get(entity_type)
+        if damageable is None:
+            damageable = any(base in self._types for base in entity_type.__mro__)
+            self._lookup[entity_type] = damageable
+        return damageable
+
+
+class HitResolver:
+    """ Resolves the attacks of a frame. Each attack only tests the hitboxes
+    near it in the CollisionWorld, damages the registered damageable
+    entities it hits, and stops projectiles at characters and walls.
+    Projectiles fly over water.
+    """
+    def __init__(self, collision_world, knockback, damageable_types = None):
+        """ Arguments:
+        collision_world -- CollisionWorld with the hitboxes of this frame.
+        knockback -- function(target, position) that pushes a hit target away
+                     from where the attack came from.
+
+        Keyword arguments:
+        damageable_types -- DamageableTypes of the entities that can take
+                            damage (default None, an empty registry)
+        """
+        self._collision = collision_world
+        self._knockback = knockback
+        self._damageable = damageable_types if damageable_types is not None else DamageableTypes()
+
+    def resolve(self, attacks):
+        """ Apply the damage and knockback of melee attacks.
+
+        Arguments:
+        attacks -- dictionary of actor -> [attack rect, weapon].
+        """
+        for actor, (attack_rect, weapon) in attacks.items():
+            if attack_rect is None:
+                continue
+            for target, hitbox in self._collision.query_dynamic(attack_rect, ignore = actor):
+                if target in self._damageable:
+                    self._knockback(target, actor.position)
+                    target.take_damage(weapon.damage)
+
+    def resolve_projectiles(self, projectiles, slots):
+        """ Apply the damage and knockback of projectiles. All projectiles are
+        tested against the characters and the walls in one vectorized pass,
+        and only the ones that hit something are handled one by one.
+
+        Arguments:
+        projectiles -- the ProjectilePool.
+        slots -- array of the slots of the projectiles that can hit, in the
+                 order their hits are applied.
+
+        Returns:
+        stopped -- array of the slots of the projectiles that hit something.
+        """
+        if len(slots) == 0:
+            return slots
+        hitboxes = projectiles.hitboxes(slots)
+        hit_characters = overlapping(hitboxes, self._collision.dynamic_boxes())
+        hit_walls = overlapping(hitboxes, self._collision.static.boxes(WALL))
+        for slot in slots[hit_characters]:
+            for target, hitbox in self._collision.query_dynamic(projectiles.hitbox(slot)):
+                if target in self._damageable:
+                    target.take_damage(projectiles.damage(slot))
+                    self._knockback(target, projectiles.position(slot))
+        return slots[hit_characters | hit_walls]
+
+    @property
+    def damageable_types(self):
+        return self._damageable
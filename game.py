@@ -1,22 +1,33 @@
-import sys
 import os
 import glob
 import time
+import argparse
 from copy import copy
 
 import pygame
 from pygame.locals import *
 import numpy as np
 
-from characters import Player, Combat_Dummy, NPC
+from characters import Character, Player, Combat_Dummy, NPC
 from items import (Weapon, Outfit, Arrow, Projectile,
                    ArrowAmmo, Ammo, Loot, Extra_Item, Quiver)
 from gameobjects import GameMap, MessageBox, Trigger
-from triggerscripts import triggerscripts
+from collision import CollisionWorld
+from combat import HitResolver, DamageableTypes
+from projectiles import ProjectilePool
+from replay import InputRecording, InputReplay
+from rendering import DirtyRects, GroundBuffer, NightOverlay, RenderQueue, in_rect
+from simclock import clock
+from maploader import MapPreloader, MapResidency
+from triggerscripts import triggerscripts, change_map_targets
 
 
 class Game:
-    def __init__(self, AA_text=True, draw_hitboxes=False, draw_triggers=False):
+    def __init__(self, AA_text=True, draw_hitboxes=False, draw_triggers=False,
+                 preload_maps=2, map_memory_budget=256*2**20, batch_motion_from=32,
+                 tick_rate=30, max_fps=60, max_ticks_per_frame=5, headless=False,
+                 record_input=None, replay_input=None, dirty_rects=True, cull_margin=64,
+                 scroll_ground=True):
         """ General setup for the game.
 
         Keyword arguments:
@@ -26,6 +37,38 @@ class Game:
                          and items (default False)
         draw_triggers -- boolean, whether or not to draw the hitboxes of triggers
                          (default False)
+        preload_maps -- the most maps reachable from the current map that are
+                        loaded in the background ahead of time (default 2)
+        map_memory_budget -- bytes of map surfaces to keep for visited maps.
+                             Least recently visited maps are unloaded down to
+                             their gameplay state beyond this (default 256 MB)
+        batch_motion_from -- with at least this many NPCs on the map, their
+                             collisions are resolved in one vectorized pass
+                             instead of one NPC at a time. None to never
+                             batch (default 32)
+        tick_rate -- simulation ticks per second. The game runs at this
+                     speed whatever the frame rate is (default 30)
+        max_fps -- the most frames rendered per second. Between frames the
+                   game sleeps. 0 for no limit (default 60)
+        max_ticks_per_frame -- the most simulation ticks run to catch up
+                               after a slow frame. Beyond this the game
+                               slows down instead (default 5)
+        headless -- run without a window or audio device, for simulating
+                    the game with 'step()' instead of playing it. Nothing
+                    is drawn and the loading screen is skipped (default False)
+        record_input -- filename to record the player input of every tick to,
+                        see replay.py (default None, no recording)
+        replay_input -- filename of a recording to play instead of reading
+                        the keyboard. The game quits when it ends. The tick
+                        rate of the recording is used (default None)
+        dirty_rects -- draw and update only the parts of the screen that
+                       changed since the last frame while the camera stands
+                       still, instead of the whole screen (default True)
+        cull_margin -- sprites are only drawn if they are within this many
+                       pixels of the screen (default 64)
+        scroll_ground -- keep the ground of the previous frame and scroll it
+                         with the camera, so only the strips coming into view
+                         are drawn from the map (default True)
         """
         self._running = True
         self._screen = None
@@ -49,6 +92,27 @@ class Game:
         self.AA_text = AA_text
         self._draw_hitboxes = draw_hitboxes
         self._draw_triggers = draw_triggers
+        self._preload_maps = preload_maps
+        self._map_memory_budget = map_memory_budget
+        self._tick_rate = tick_rate
+        self._max_fps = max_fps
+        self._max_ticks_per_frame = max_ticks_per_frame
+        self._headless = headless
+        self._record_input = record_input
+        self._replay_input = replay_input
+        self._dirty_rects = dirty_rects
+        self._cull_margin = cull_margin
+        self._scroll_ground = scroll_ground
+        self._render_queue = RenderQueue()
+        self._drawn_sprites = 0
+        self._culled_sprites = 0
+        self._recording = None
+        self._replay = None
+        self._interpolation = 1 # how far rendering is between the start and end of the last tick
+        self._snap_render = True # draw the end of the last tick, e.g. after a map change
+        self._tick_start_cam = (0, 0)
+        self.fps = 0
+        self._batch_motion_from = batch_motion_from
 
     def load_image_folder(self, folder_name, dict):
         """ Load images from all sprite folders with the given folder name
@@ -396,6 +460,9 @@ class Game:
     """ Game initalization """
     def init_game(self):
         """ Loads and sets up the game. """
+        if self._headless:
+            os.environ["SDL_VIDEODRIVER"] = "dummy"
+            os.environ["SDL_AUDIODRIVER"] = "dummy"
         pygame.init()
         pygame.display.set_caption("Game")
         self._screen = pygame.display.set_mode(self._size, pygame.HWSURFACE | pygame.DOUBLEBUF)
@@ -405,18 +472,26 @@ class Game:
         self.font_normal = pygame.font.Font(os.path.join(os.getcwd(), "font", "Amatic-Bold.ttf"), 25)
         self.font_big = pygame.font.Font(os.path.join(os.getcwd(), "font", "Amatic-Bold.ttf"), 30)
         self.loadingtext = self.font_big.render("Loading...", self.AA_text, self.WHITE)
+        fps_rect = pygame.Rect(self._width - 80, 5, 80, self.font_normal.get_height())
+        bars_rect = pygame.Rect(self._width - 221, self._height - 31, 212, 22) # health and stamina bars
+        self._dirty = DirtyRects(self._screen.get_rect(), always = [fps_rect, bars_rect])
+        self._ground = GroundBuffer(self._size)
+        self._night = NightOverlay(self._size)
 
         self._screen.blit(self.loadingtext, (self._width/2 - self.loadingtext.get_width()/2,
                                              self._height/2 - self.loadingtext.get_height()/2))
         pygame.display.flip()
         print("Loading...")
 
-        self.map = None
-        self._current_map_name = None
-        self._maps = {}
+        self._maps = MapResidency(budget_bytes = self._map_memory_budget)
+        self._preloader = MapPreloader(max_maps = self._preload_maps)
+        self._collision = CollisionWorld()
+        self._hits = HitResolver(self._collision, self.knockback, DamageableTypes([Character, Combat_Dummy]))
+        self._projectiles = ProjectilePool(self.make_projectile_frames)
 
-        pygame.mixer.init()
-        pygame.mixer.music.load(os.path.join(os.getcwd(), "music", "pugnateii.mp3"))
+        if not self._headless:
+            pygame.mixer.init()
+            pygame.mixer.music.load(os.path.join(os.getcwd(), "music", "pugnateii.mp3"))
 
         self._clock = pygame.time.Clock()
 
@@ -456,8 +531,30 @@ class Game:
                         "combat_dummy": self._combat_dummy_images}
 
         self.load_legionarmor()
+        self._projectiles.register_type(Arrow)
 
         self.hands_icon = self.get_icon("hands")
+        self.new_game()
+        print("Loading completed...")
+
+    def new_game(self):
+        """ Start the game from the beginning, with all maps as they are in
+        their files.
+        """
+        self.map = None
+        self._current_map_name = None
+        self._maps.clear()
+
+        if self._recording is not None:
+            self._recording.close()
+            self._recording = None
+        if self._record_input is not None:
+            self._recording = InputRecording(self._record_input, self._tick_rate)
+        if self._replay_input is not None:
+            self._replay = InputReplay(self._replay_input)
+            self._tick_rate = self._replay.tick_rate
+        clock.reset(1/self._tick_rate)
+
         hands = Weapon("Hands", self.hands_icon, type_ = "slash", damage = 2)
 
         plainclothes = self.make_plainclothes()
@@ -470,7 +567,6 @@ class Game:
         init_script = triggerscripts["game_init"]
         init_values = init_script()
 
-        self._projectiles = []
         map_name, new_player_position, new_cam_position = init_values[2]
         self.load_new_map(map_name, new_player_position, new_cam_position)
 
@@ -502,7 +598,6 @@ class Game:
         self._loop_func = self.standard_loop
         self._unpaused_render = self.standard_render
         self._paused_render = self.inventory_render
-        print("Loading completed...")
 
     def manual_initial_item_setup(self):
         """ For adding extra items to the map or player on startup. """
@@ -523,6 +618,9 @@ class Game:
         if event.type == pygame.QUIT:
             self._running = False
 
+        if event.type == pygame.VIDEOEXPOSE:
+            self._dirty.invalidate()
+
         if event.type == pygame.MOUSEBUTTONDOWN:
             if event.button == 1:
                 if self._paused:
@@ -569,7 +667,7 @@ class Game:
                 else:
                     self._paused = True
                     self._inventory = True
-                    self._pausebg = self._screen.copy()
+                    self._pausebg = self.make_pause_background()
                     self._paused_render = self.inventory_render
 
     def load_new_map(self, new_map, new_player_position = None, new_cam_position = None):
@@ -588,16 +686,20 @@ class Game:
 
         if the position arguments are None, the values will be loaded from the
         values stored in the new_map GameMap object.
+
+        Maps that were visited before or preloaded in the background are
+        switched to directly, without showing the loading screen.
         """
         load_start = time.time()
-        self._unpaused_render = self.loading_render
-        self._paused_render = self.loading_render
+        map_ready = self._maps.is_loaded(new_map) or new_map in self._preloader.ready
 
-        while len(self._projectiles) > 0:
-            self._projectiles.pop()
+        self._projectiles.clear()
 
-        if self.map != None:
-            self.render()
+        if not map_ready and not self._headless:
+            self._unpaused_render = self.loading_render
+            self._paused_render = self.loading_render
+            if self.map != None:
+                self.render()
 
         if new_player_position is None:
             new_player_position = self._maps[new_map].stored_player_position
@@ -609,13 +711,18 @@ class Game:
             origmap.store_data(self.npcs.copy(), self.loot.copy(), self.player.position.copy(), (self._cam_x, self._cam_y))
 
         if not new_map in self._maps:
-            new_map_object = GameMap(new_map)
+            new_map_object = self._preloader.take(new_map)
+            if new_map_object is None:
+                new_map_object = GameMap(new_map)
             self._maps[new_map] = new_map_object
-        else:
-            new_map_object = self._maps[new_map]
+        new_map_object = self._maps.visit(new_map)
 
         self._current_map_name = new_map
         self.map = copy(new_map_object)
+        self._dirty.invalidate()
+        self._ground.invalidate()
+        self._collision.set_static(self.map.static_hitboxes)
+        self._collision.clear_dynamic()
 
         npcs, loot, player_position, camera_position = self.map.retrieve_data()
         if new_player_position is None:
@@ -628,14 +735,20 @@ class Game:
         self.npcs = npcs
         self.loot = loot
         self.player.set_pos(new_player_position)
+        self.map.stream_regions(self.player.position, wait=True)
         self._cam_x, self._cam_y = new_cam_position
+        self._snap_render = True
         self._mapwidth = self.map.width
         self._mapheight = self.map.height
 
+        self._preloader.preload(map_name for map_name in change_map_targets(self.map.trigger_names)
+                                if map_name not in self._maps)
+
         load_end = time.time()
 
-        time.sleep(max(0.3 - (load_end - load_start),0)) # keep the loading screen for at least 0.3 seconds
-                                                         # because an instant skip looks unnatural
+        if not map_ready and not self._headless:
+            time.sleep(max(0.3 - (load_end - load_start),0)) # keep the loading screen for at least 0.3 seconds
+                                                             # because an instant skip looks unnatural
         self._unpaused_render = self.standard_render
         self._paused_render = self.inventory_render
 
@@ -656,21 +769,36 @@ class Game:
                     x, y = rect.center
                     if direction == 1 or direction == 3:
                         y -= 12 # move arrow up to align with character
-                    new_projectile = character.equipped_ammo.projectile_type(x, y, direction)
+                    self._projectiles.spawn(character.equipped_ammo.projectile_type, x, y, direction)
                     character.equipped_ammo.reduce_amount()
-                    img_ = new_projectile.image
-                    layer = self._images[img_[0]][img_[1]]
-                    projectile_surf = pygame.Surface((64, 64), pygame.SRCALPHA)
-                    if direction != 0:
-                        projectile_surf.blit(layer, (0, 0), (768, int(direction*64), 64, 64))
-                    else:
-                        projectile_surf.blit(layer, (0, 0), (768, 128, 64, 64))
-                        projectile_surf = pygame.transform.flip(projectile_surf, 1, 1)
-
-                    self._projectiles.append([new_projectile, projectile_surf])
             else:
                 self.attack_rects[character] = char_data[2]
 
+    def make_projectile_frames(self, image):
+        """ Make the sprites of a projectile image for the four directions.
+
+        Arguments:
+        image -- [animation, layer] of the image in self._images.
+
+        Returns:
+        frames -- list of the 64x64 sprites for up, left, down and right.
+        """
+        layer = self._images[image[0]][image[1]]
+        frames = []
+        for direction in range(4):
+            projectile_surf = pygame.Surface((64, 64), pygame.SRCALPHA)
+            if direction != 0:
+                projectile_surf.blit(layer, (0, 0), (768, int(direction*64), 64, 64))
+            else:
+                projectile_surf.blit(layer, (0, 0), (768, 128, 64, 64))
+                projectile_surf = pygame.transform.flip(projectile_surf, 1, 1)
+            frames.append(projectile_surf)
+        return frames
+
+    def knockback(self, target, position):
+        """ Push a character that was hit away from where the attack came from. """
+        self.character_motion(target.position, target.position - position, target, self._collision.hitbox(target))
+
     def character_motion(self, char_position, movement, character, characterhitbox):
         if not character.can_move:
             return
@@ -678,31 +806,22 @@ class Game:
         movement_x = movement[0]
         movement_y = movement[1]
         """ Collision testing the character """
-        if character in self.hitboxes:
-            hitboxes_no_character = self.hitboxes.copy()
-            del hitboxes_no_character[character]
-        else:
-            hitboxes_no_character = self.hitboxes
         if movement_x > 0:
             candidate_hitbox = characterhitbox.move(movement_x + 1, 0)
-            collides = candidate_hitbox.collidedict(hitboxes_no_character, 1)
-            if collides is not None:
+            if self._collision.collides(candidate_hitbox, ignore = character):
                 movement_x = 0
         elif movement_x < 0:
             candidate_hitbox = characterhitbox.move(movement_x - 1, 0)
-            collides = candidate_hitbox.collidedict(hitboxes_no_character, 1)
-            if collides is not None:
+            if self._collision.collides(candidate_hitbox, ignore = character):
                 movement_x = 0
 
         if movement_y > 0:
             candidate_hitbox = characterhitbox.move(0, movement_y + 1)
-            collides = candidate_hitbox.collidedict(hitboxes_no_character, 1)
-            if collides is not None:
+            if self._collision.collides(candidate_hitbox, ignore = character):
                 movement_y = 0
         elif movement_y < 0:
             candidate_hitbox = characterhitbox.move(0, movement_y - 1)
-            collides = candidate_hitbox.collidedict(hitboxes_no_character, 1)
-            if collides is not None:
+            if self._collision.collides(candidate_hitbox, ignore = character):
                 movement_y = 0
 
         candidate_pos[0] += movement_x
@@ -710,26 +829,56 @@ class Game:
 
         character.set_pos(candidate_pos)
 
+    def batched_character_motion(self, characters, char_datas):
+        """ Move several characters at once, resolving all their collisions in
+        one vectorized pass. Gives the same result as calling
+        'character_motion()' for each character in order and adding its
+        hitbox to the collision world after it has moved.
+
+        Arguments:
+        characters -- list of characters.
+        char_datas -- list of the data returned by each character's 'step()'.
+        """
+        movements = self._collision.move_batch(characters,
+                                               [char_data[3] for char_data in char_datas],
+                                               [char_data[4] for char_data in char_datas])
+        for character, char_data, movement in zip(characters, char_datas, movements):
+            if not character.can_move:
+                continue
+            candidate_pos = char_data[0].copy()
+            candidate_pos[0] += movement[0]
+            candidate_pos[1] += movement[1]
+            character.set_pos(candidate_pos)
+
     """ Game loop methods """
     def standard_loop(self, action, move_array, key_states):
         """ Normal gameplay loop """
+        self._snap_render = False
+        self._tick_start_cam = (self._cam_x, self._cam_y)
+        self.map.stream_regions(self.player.position)
+
         """ Player step """
         self._player_data = self.player.step(self._day_time, action, move_array, key_states[pygame.K_LSHIFT])
         self.character_attack(self._player_data, self.player)
 
-        self.hitboxes[self.player] = self._player_data[3]
-        
-        for _, hitbox in self.map.collision_hitboxes + self.map.water_hitboxes:
-            self.hitboxes[_] = hitbox
+        self._collision.update(self.player, self._player_data[3])
 
         """ NPC steps """
         self._npc_datas = []
-        for npc in self.npcs:
-            npc_data = npc.step(self._day_time, self._player_data[0])
-            self.character_motion(npc_data[0], npc_data[4], npc, npc_data[3])
-            self.hitboxes[npc] = npc_data[3]
-            self._npc_datas.append(npc_data)
-            self.character_attack(npc_data, npc)
+        self._stepped_npcs = list(self.npcs)
+        if self._batch_motion_from is not None and len(self.npcs) >= self._batch_motion_from:
+            for npc in self.npcs:
+                self._npc_datas.append(npc.step(self._day_time, self._player_data[0]))
+            self.batched_character_motion(self.npcs, self._npc_datas)
+            for npc, npc_data in zip(self.npcs, self._npc_datas):
+                self.character_attack(npc_data, npc)
+        else:
+            for npc in self.npcs:
+                npc_data = npc.step(self._day_time, self._player_data[0])
+                self.character_motion(npc_data[0], npc_data[4], npc, npc_data[3])
+                self._collision.update(npc, npc_data[3])
+                self._npc_datas.append(npc_data)
+                self.character_attack(npc_data, npc)
 
         """ Check for loot pickups """
         del_loot = []
@@ -751,42 +900,14 @@ class Game:
             if loot in self.loot:
                 self.loot.remove(loot)
 
-        """ Step projectiles and check if they have existed for too long """
-        del_projectiles = []
-        for projectile in self._projectiles:
-            hitbox = projectile[0].step()
-            if projectile[0].timer > 5 and projectile[0].timer <= 200:
-                self.attack_rects[projectile[0]] = [hitbox, projectile]
-            elif projectile[0].timer > 200:
-                del_projectiles.append(projectile)
+        """ Step projectiles, removing the ones that have existed for too long """
+        armed_projectiles = self._projectiles.step()
 
         """ Check hitboxes for weapon hits """
-        for actor, attack_rect in self.attack_rects.items():
-            attack_rect, attack_weapon = attack_rect
-            for target, hitbox in self.hitboxes.items():
-                if actor == target or attack_rect is None:
-                    continue
-                if attack_rect.colliderect(hitbox):
-                    try:
-                        if isinstance(attack_weapon, list):
-                            target.take_damage(attack_weapon[0].damage)
-                            self.character_motion(target.position, target.position - actor.position, target, self.hitboxes[target])
-                            if isinstance(attack_weapon[0], Projectile):
-                                del_projectiles.append(attack_weapon)
-                        else:
-                            self.character_motion(target.position, target.position - actor.position, target, self.hitboxes[target])
-                            target.take_damage(attack_weapon.damage)
-                    except AttributeError:
-                        """ Target can't take damage """
-                        if isinstance(attack_weapon, list):
-                            if isinstance(attack_weapon[0], Projectile) and not "wmapobj" in target:
-                                del_projectiles.append(attack_weapon)
-
-        for projectile in del_projectiles:
-            if projectile in self._projectiles:
-                self._projectiles.remove(projectile)
-
-        playerhitbox = self.hitboxes[self.player]
+        self._hits.resolve(self.attack_rects)
+        self._projectiles.remove(self._hits.resolve_projectiles(self._projectiles, armed_projectiles))
+
+        playerhitbox = self._collision.hitbox(self.player)
         candidate_pos = self._player_data[0].copy()
         movement_x = self._player_data[4][0]
         movement_y = self._player_data[4][1]
@@ -833,28 +954,22 @@ class Game:
                     
                     
         """ Collision testing the player """
-        hitboxes_no_player = self.hitboxes.copy()
-        del hitboxes_no_player[self.player]
         if movement_x > 0:
             candidate_hitbox = playerhitbox.move(movement_x + 1, 0)
-            collides = candidate_hitbox.collidedict(hitboxes_no_player, 1)
-            if collides is not None:
+            if self._collision.collides(candidate_hitbox, ignore = self.player):
                 movement_x = 0
         elif movement_x < 0:
             candidate_hitbox = playerhitbox.move(movement_x - 1, 0)
-            collides = candidate_hitbox.collidedict(hitboxes_no_player, 1)
-            if collides is not None:
+            if self._collision.collides(candidate_hitbox, ignore = self.player):
                 movement_x = 0
 
         if movement_y > 0:
             candidate_hitbox = playerhitbox.move(0, movement_y + 1)
-            collides = candidate_hitbox.collidedict(hitboxes_no_player, 1)
-            if collides is not None:
+            if self._collision.collides(candidate_hitbox, ignore = self.player):
                 movement_y = 0
         elif movement_y < 0:
             candidate_hitbox = playerhitbox.move(0, movement_y - 1)
-            collides = candidate_hitbox.collidedict(hitboxes_no_player, 1)
-            if collides is not None:
+            if self._collision.collides(candidate_hitbox, ignore = self.player):
                 movement_y = 0
 
         candidate_pos[0] += movement_x
@@ -899,14 +1014,30 @@ class Game:
             self._messageboxes.append(sunset_msgbox)
             self._has_displayed_sunset_msgbox = True
 
-    def loop(self):
+    def loop(self, key_states = None):
+        """ Run one simulation tick
+
+        Keyword arguments:
+        key_states -- the keys held down, indexed by pygame key constants like
+                      the result of pygame.key.get_pressed(). None to read
+                      the keyboard (default None)
+        """
         self.attack_rects = {}
-        self.hitboxes = {}
+        self._collision.clear_dynamic()
         if not self._paused:
             """ Unpaused loop """
 
             """ Player controls """
-            key_states = pygame.key.get_pressed()
+            if self._replay is not None:
+                key_states = self._replay.next()
+                if key_states is None:
+                    print("Replay finished")
+                    self._running = False
+                    return
+            elif key_states is None:
+                key_states = pygame.key.get_pressed()
+            if self._recording is not None:
+                self._recording.record(key_states)
             move_array = np.zeros(4)
             action = None
             if key_states[pygame.K_SPACE]:
@@ -924,6 +1055,7 @@ class Game:
                 action = 3
                 move_array[3] = 1
             
+            clock.advance()
             self._loop_func(action, move_array, key_states)
         else:
             """ Paused loop """
@@ -931,42 +1063,37 @@ class Game:
             self._inv_x = (mouse_pos[0] - 32)//64
             self._inv_y = (mouse_pos[1] - 64)//64
 
-        self._clock.tick_busy_loop(30)
-        self.fps = self._clock.get_fps()
-
 
     """ Game render methods """
     def standard_render(self, cam_x, cam_y, campos):
-        black_bg = pygame.Rect(0, 0, self._width, self._height)
-        pygame.draw.rect(self._screen, self.BLACK, black_bg)
-        self._screen.blit(self.map.ground_surf, (0 - cam_x, 0 - cam_y))
+        camera_rect = pygame.Rect(cam_x, cam_y, self._width, self._height)
 
         shadow_state = int(self._day_time//5)
 
         """ get player surf """
-        p_position = self._player_data[0]
+        p_position = self.interpolate(self._player_data[0], self.player.position)
         player_surf = self._player_data[1]
         shadow = self._player_data[5]
         sprite_size = player_surf.get_width()
 
-        shadows = {}
+        shadows = []
         item_surfs = []
         item_positions = []
         yshifts = []
         healthbars = []
 
         if shadow_state <= 20:
-            shadows[shadow] = (p_position[0] - sprite_size//2, p_position[1] + sprite_size//2 - 8)
+            shadows.append((shadow, (p_position[0] - sprite_size//2, p_position[1] + sprite_size//2 - 8)))
         else:
-            shadows[shadow] = (p_position[0] - sprite_size//2, p_position[1] + sprite_size//2 - shadow.get_height() - 3)
+            shadows.append((shadow, (p_position[0] - sprite_size//2, p_position[1] + sprite_size//2 - shadow.get_height() - 3)))
 
         item_surfs.append(player_surf)
         item_positions.append([p_position[0] - sprite_size//2, p_position[1] - sprite_size//2])
         yshifts.append(0)
 
         """ get NPC surfs """
-        for npc_data in self._npc_datas:
-            npc_position = npc_data[0]
+        for npc, npc_data in zip(self._stepped_npcs, self._npc_datas):
+            npc_position = self.interpolate(npc_data[0], npc.position)
             npc_surf = npc_data[1]
             yshifts.append(npc_data[6])
             shadow = npc_data[5]
@@ -975,158 +1102,204 @@ class Game:
                 healthbars.append(npc_data[7])
 
             if shadow_state <= 20:
-                shadows[shadow] = (npc_position[0] - sprite_size//2, npc_position[1] + sprite_size//2 - 8)
+                shadows.append((shadow, (npc_position[0] - sprite_size//2, npc_position[1] + sprite_size//2 - 8)))
             else:
-                shadows[shadow] = (npc_position[0] - sprite_size//2, npc_position[1] + sprite_size//2 - shadow.get_height() - 3)
+                shadows.append((shadow, (npc_position[0] - sprite_size//2, npc_position[1] + sprite_size//2 - shadow.get_height() - 3)))
 
             item_surfs.append(npc_surf)
             item_positions.append([npc_position[0] - sprite_size//2, npc_position[1] - sprite_size//2 - yshifts[-1]])
 
         """ get projectile surfs """
-        for projectile, surf in self._projectiles:
-            projectile_position = projectile.position - 32
+        for surf, projectile_position in self._projectiles.sprites(1 if self._snap_render else self._interpolation):
             item_surfs.append(surf)
             item_positions.append(projectile_position)
             yshifts.append(0)
 
-        """ get static map object surfs """
-        for surf, y in self.map.collision_obj_surfs:
-            item_surfs.append(surf)
-            item_positions.append(np.array([0, y - 32]))
-            yshifts.append(32)
-
         for loot in self.loot:
             item_surfs.append(loot.image)
             item_positions.append(loot.position - 32)
             yshifts.append(0)
 
-        item_surfs = np.array(item_surfs)
-        item_positions = np.array(item_positions)
-        yshifts = np.array(yshifts)
-
-        inds = item_positions[:,1].argsort()
-            
-        item_surfs = item_surfs[inds]
-        item_positions = item_positions[inds]
-        yshifts = yshifts[inds]
+        """ Sort the sprites in view into drawing order """
+        static_key = (self._current_map_name, self.map.revision, len(self.map.collision_obj_surfs))
+        if self._render_queue.static_key != static_key:
+            strips = self.map.collision_obj_surfs
+            self._render_queue.set_static(static_key, [surf for surf, x, y in strips],
+                                          np.array([[x, y] for surf, x, y in strips]),
+                                          np.array([y - 32 for surf, x, y in strips]))
+        item_positions = np.array(item_positions, dtype=float)
+        sort_y = item_positions[:,1].copy()
+        item_positions[:,1] += yshifts
+        visible = camera_rect.inflate(2*self._cull_margin, 2*self._cull_margin)
+        item_surfs, item_positions, item_sizes, moving, culled = self._render_queue.build(visible, item_surfs, item_positions, sort_y)
+        item_positions = item_positions.astype(int) - campos
+
+        shadows_in_view = [(shadow, pos) for shadow, pos in shadows if visible.colliderect(pygame.Rect(pos, shadow.get_size()))]
+        self._drawn_sprites = len(item_surfs) + len(shadows_in_view)
+        self._culled_sprites = culled + len(shadows) - len(shadows_in_view)
+        shadows = shadows_in_view
+
+        if self.map.outdoors and self._day_time <= 200:
+            shadows = [(shadow, (int(x - cam_x), int(y - cam_y))) for shadow, (x, y) in shadows]
+        else:
+            shadows = []
 
-        """ Draw shadows """
-        if self.map.outdoors:
-            if self._day_time <= 200:
-                for shadow, pos in shadows.items():
-                    pos = np.array(pos) - campos
-                    self._screen.blit(shadow, pos)
-
-        """ Draw characters and items """
-        for surf, pos, yshift in zip(item_surfs, item_positions, yshifts):
-            try:
-                pos[1] += yshift
-                pos = pos.astype(int) - campos
-                self._screen.blit(surf, pos)
-            except Exception as e:
-                print(e)
-                print(pos)
-                sys.exit(1)
-        
-        """ Draw items that are always above """
-        self._screen.blit(self.map.above_surf, (0 - cam_x, 0 - cam_y))
+        healthbars = [(fg.move(-cam_x, -cam_y), bg.move(-cam_x, -cam_y)) for fg, bg in healthbars]
 
-        """ Draw night effect """
-        if self.map.outdoors:
-            night = pygame.surface.Surface((self._width, self._height), pygame.HWSURFACE)
-            alpha = None
-            if self._day_time > 175 and self._day_time < 250:
-                alpha = (255 - abs(250 - self._day_time)*3)/2  
-            elif self._day_time >= 250 and self._day_time < 350:
-                alpha = 255/2
-            elif self._day_time >= 350:
-                alpha = (255 - abs(350 - self._day_time)*3)/2
-            elif self._day_time <= 25:
-                alpha = (255 - abs(-self._day_time - 50)*3)/2
-
-            if alpha is not None:
-                night.fill((0, 0, 0))
-                night.set_alpha(alpha)
-                self._screen.blit(night, (0, 0))
+        night = self._night.update(self.night_alpha() if self.map.outdoors else None)
 
-        """ Draw healthbars """
-        for healthbar in healthbars:
-            bg = healthbar[1]
-            fg = healthbar[0]
-            fg.move_ip(-cam_x, -cam_y)
-            bg.move_ip(-cam_x, -cam_y)
-            pygame.draw.rect(self._screen, self.RED, bg)
-            if fg.width > 0:
-                pygame.draw.rect(self._screen, self.GREEN, fg)
-
-        """ Draw hitboxes if set true """
-        if self._draw_hitboxes:
-            hitboxes_surf = pygame.surface.Surface((self._width, self._height), pygame.SRCALPHA)
-            for a, hitbox in self.hitboxes.items():
-                draw_hitbox = hitbox.move(-cam_x, -cam_y)
-                pygame.draw.rect(hitboxes_surf, (255, 255, 255, 150), draw_hitbox)
-
-            for a, hitbox in self.map.water_hitboxes:
-                draw_hitbox = hitbox.move(-cam_x, -cam_y)
-                pygame.draw.rect(hitboxes_surf, (0, 0, 255, 150), draw_hitbox)
-
-            for projectile, a in self._projectiles:
-                hitbox = projectile.hitbox
-                draw_hitbox = hitbox.move(-cam_x, -cam_y)
-                pygame.draw.rect(hitboxes_surf, (0, 255, 255, 100), draw_hitbox)
-
-            self._screen.blit(hitboxes_surf, (0,0))
-
-        if self._draw_triggers:
-            for a, trigger in self.map.triggers.items():
-                draw_trigger = trigger.move(-cam_x, -cam_y)
-                pygame.draw.rect(self._screen, self.GREY, draw_trigger)
-
-        """ Draw UI elements """
         hour = int(self._day_time/400*24) + 1
         if self._day_time < 200:
             time_text = self.font_normal.render(f"It is currently hour: {hour}", self.AA_text, self.WHITE)
         else:
             time_text = self.font_normal.render(f"It is currently night", self.AA_text, self.WHITE)
 
-        hbar_width = 100
-        hbar_height = 20
-        health_width = int(self.player.health/self.player.maxhealth*hbar_width)
-        player_health_bg = pygame.Rect(self._width - 10 - hbar_width, self._height - 10 - hbar_height, hbar_width, hbar_height)
-        player_health_border = pygame.Rect(self._width - 11 - hbar_width, self._height - 11 - hbar_height, hbar_width + 2, hbar_height + 2)
-        player_health = pygame.Rect(self._width - 10 - hbar_width, self._height - 10 - hbar_height, health_width, hbar_height)
-        pygame.draw.rect(self._screen, self.GREY, player_health_border)
-        pygame.draw.rect(self._screen, self.DARKRED, player_health_bg)
-        if self.player.health > 0:
-            pygame.draw.rect(self._screen, self.DARKERRED, player_health)
-
-        stamina = max(self.player.stamina, 0)
-        stamina_width = int(stamina/self.player.maxstamina*hbar_width)
-        player_stamina_bg = pygame.Rect(self._width - 20 - hbar_width*2, self._height - 10 - hbar_height, hbar_width, hbar_height)
-        player_stamina_border = pygame.Rect(self._width - 21 - hbar_width*2, self._height - 11 - hbar_height, hbar_width + 2, hbar_height + 2)
-        player_stamina = pygame.Rect(self._width - 20 - hbar_width*2, self._height - 10 - hbar_height, stamina_width, hbar_height)
-        pygame.draw.rect(self._screen, self.GREY, player_stamina_border)
-        pygame.draw.rect(self._screen, self.DARKGREEN, player_stamina_bg)
-        if stamina > 0:
-            pygame.draw.rect(self._screen, self.DARKERGREEN, player_stamina)
-        
-        self._screen.blit(time_text, (5, self._height - 35))
+        """ Find the parts of the screen that changed since the last frame """
+        changed = [pygame.Rect(pos, surf.get_size()).inflate(2, 2) for surf, pos in shadows]
+        changed += [pygame.Rect(pos, size).inflate(2, 2) for pos, size in zip(item_positions[moving], item_sizes[moving])]
+        changed += [bg for fg, bg in healthbars]
+        if self._draw_hitboxes or self._draw_triggers:
+            self._dirty.invalidate()
+        view = (cam_x, cam_y, self._current_map_name, self.map.revision, self._night.alpha, hour, self._day_time < 200)
+        areas = self._dirty.update(view, changed)
+
+        if self._scroll_ground:
+            ground = self._ground.update(self.map.ground_layer, camera_rect,
+                                         (self._current_map_name, self.map.revision))
+
+        for area in [None] if areas is None else areas:
+            self._screen.set_clip(area)
+            if area is None:
+                in_area = slice(None)
+            else:
+                in_area = in_rect(item_positions[:,0], item_positions[:,1], item_sizes, area)
+            sprites = list(zip(item_surfs[in_area], item_positions[in_area].tolist()))
+
+            if self._scroll_ground:
+                self._screen.blit(ground, (0, 0))
+            else:
+                black_bg = pygame.Rect(0, 0, self._width, self._height)
+                pygame.draw.rect(self._screen, self.BLACK, black_bg)
+                self.map.ground_layer.draw(self._screen, camera_rect)
+
+            """ Draw shadows, characters and items """
+            self._screen.blits(shadows + sprites, doreturn=False)
+
+            """ Draw items that are always above """
+            self.map.above_layer.draw(self._screen, camera_rect)
+
+            """ Draw night effect """
+            if night is not None:
+                self._screen.blit(night, (0, 0))
+
+            """ Draw healthbars """
+            for fg, bg in healthbars:
+                pygame.draw.rect(self._screen, self.RED, bg)
+                if fg.width > 0:
+                    pygame.draw.rect(self._screen, self.GREEN, fg)
+
+            """ Draw hitboxes if set true """
+            if self._draw_hitboxes:
+                hitboxes_surf = pygame.surface.Surface((self._width, self._height), pygame.SRCALPHA)
+                for a, hitbox in list(self._collision.dynamic.items()) + self.map.collision_hitboxes + self.map.water_hitboxes:
+                    draw_hitbox = hitbox.move(-cam_x, -cam_y)
+                    pygame.draw.rect(hitboxes_surf, (255, 255, 255, 150), draw_hitbox)
+
+                for a, hitbox in self.map.water_hitboxes:
+                    draw_hitbox = hitbox.move(-cam_x, -cam_y)
+                    pygame.draw.rect(hitboxes_surf, (0, 0, 255, 150), draw_hitbox)
+
+                for x, y, width, height in self._projectiles.hitboxes():
+                    draw_hitbox = pygame.Rect(x - cam_x, y - cam_y, width, height)
+                    pygame.draw.rect(hitboxes_surf, (0, 255, 255, 100), draw_hitbox)
+
+                self._screen.blit(hitboxes_surf, (0,0))
+
+            if self._draw_triggers:
+                for a, trigger in self.map.triggers.items():
+                    draw_trigger = trigger.move(-cam_x, -cam_y)
+                    pygame.draw.rect(self._screen, self.GREY, draw_trigger)
+
+            """ Draw UI elements """
+            hbar_width = 100
+            hbar_height = 20
+            health_width = int(self.player.health/self.player.maxhealth*hbar_width)
+            player_health_bg = pygame.Rect(self._width - 10 - hbar_width, self._height - 10 - hbar_height, hbar_width, hbar_height)
+            player_health_border = pygame.Rect(self._width - 11 - hbar_width, self._height - 11 - hbar_height, hbar_width + 2, hbar_height + 2)
+            player_health = pygame.Rect(self._width - 10 - hbar_width, self._height - 10 - hbar_height, health_width, hbar_height)
+            pygame.draw.rect(self._screen, self.GREY, player_health_border)
+            pygame.draw.rect(self._screen, self.DARKRED, player_health_bg)
+            if self.player.health > 0:
+                pygame.draw.rect(self._screen, self.DARKERRED, player_health)
+
+            stamina = max(self.player.stamina, 0)
+            stamina_width = int(stamina/self.player.maxstamina*hbar_width)
+            player_stamina_bg = pygame.Rect(self._width - 20 - hbar_width*2, self._height - 10 - hbar_height, hbar_width, hbar_height)
+            player_stamina_border = pygame.Rect(self._width - 21 - hbar_width*2, self._height - 11 - hbar_height, hbar_width + 2, hbar_height + 2)
+            player_stamina = pygame.Rect(self._width - 20 - hbar_width*2, self._height - 10 - hbar_height, stamina_width, hbar_height)
+            pygame.draw.rect(self._screen, self.GREY, player_stamina_border)
+            pygame.draw.rect(self._screen, self.DARKGREEN, player_stamina_bg)
+            if stamina > 0:
+                pygame.draw.rect(self._screen, self.DARKERGREEN, player_stamina)
+            
+            self._screen.blit(time_text, (5, self._height - 35))
+
+        self._screen.set_clip(None)
+
+    def night_alpha(self):
+        """ Opacity of the darkness over outdoor maps at the current time of
+        day, or None during the day.
+        """
+        alpha = None
+        if self._day_time > 175 and self._day_time < 250:
+            alpha = (255 - abs(250 - self._day_time)*3)/2  
+        elif self._day_time >= 250 and self._day_time < 350:
+            alpha = 255/2
+        elif self._day_time >= 350:
+            alpha = (255 - abs(350 - self._day_time)*3)/2
+        elif self._day_time <= 25:
+            alpha = (255 - abs(-self._day_time - 50)*3)/2
+        return alpha
 
     def loading_render(self, cam_x, cam_y, campos):
+        self._dirty.invalidate()
+        self._dirty.update(None, [])
         black_bg = pygame.Rect(0, 0, self._width, self._height)
         pygame.draw.rect(self._screen, self.BLACK, black_bg)
         self._screen.blit(self.loadingtext, (self._width/2 - self.loadingtext.get_width()/2,
                                              self._height/2 - self.loadingtext.get_height()/2))
 
     def inventory_render(self, cam_x, cam_y, campos):
-        self._hover_item = None
-        self._screen.blit(self._pausebg, (0,0))
+        """ Draw the inventory again only where it changed, which is nowhere
+        until the mouse moves or the inventory changes.
+        """
+        player_inventory = self.player.get_inventory()
+        view = ("inventory", self._inv_x, self._inv_y,
+                tuple((id(item), getattr(item, "amount", None)) for item in player_inventory.values()),
+                tuple(id(item) for item in self.player.get_outfits()),
+                id(self.player.equipped_weapon), id(self.player.equipped_outfit), id(self.player.equipped_ammo))
+        areas = self._dirty.update(view, [])
+        for area in [None] if areas is None else areas:
+            self._screen.set_clip(area)
+            self.draw_inventory()
+        self._screen.set_clip(None)
+
+    def make_pause_background(self):
+        """ The last frame of the game, darkened and with the inventory menu
+        on top, as the background of the inventory screen.
+        """
+        background = self._screen.copy()
         fill_rect = pygame.Rect(0, 0, self._width, self._height)
         surf = pygame.Surface((self._width, self._height))
         pygame.draw.rect(surf, self.BLACK, fill_rect)
         surf.set_alpha(155)
-        self._screen.blit(surf, (0,0))
-        self._screen.blit(self._inventory_menu, (0,0))
+        background.blit(surf, (0,0))
+        background.blit(self._inventory_menu, (0,0))
+        return background
+
+    def draw_inventory(self):
+        self._hover_item = None
+        self._screen.blit(self._pausebg, (0,0))
 
         inv_matrix = []
         player_inventory = self.player.get_inventory()
@@ -1201,22 +1374,33 @@ class Game:
             self._screen.blit(valtext, (text_x, text_y))
             self._screen.blit(icon, (586, 74))
 
+    def interpolate(self, start, end):
+        """ Where to draw something that moved from 'start' to 'end' during
+        the last simulation tick.
+        """
+        if self._snap_render or self._interpolation == 1:
+            return end
+        return start + (end - start)*self._interpolation
+
     def render(self):
+        cam_x, cam_y = self._cam_x, self._cam_y
+        if not self._snap_render and self._interpolation != 1:
+            cam_x = round(self.interpolate(self._tick_start_cam[0], cam_x))
+            cam_y = round(self.interpolate(self._tick_start_cam[1], cam_y))
         if self.map.outdoors:
-            cam_x = min(max(self._cam_x, 0), self._mapwidth - self._width)
-            cam_y = min(max(self._cam_y, 0), self._mapheight - self._height)
-        else:
-            cam_x = self._cam_x
-            cam_y = self._cam_y
+            cam_x = min(max(cam_x, 0), self._mapwidth - self._width)
+            cam_y = min(max(cam_y, 0), self._mapheight - self._height)
 
         campos = np.array([cam_x, cam_y])
+        if not self._dirty_rects or (self._messageboxes and not self._paused):
+            self._dirty.invalidate()
         if not self._paused:
             self._unpaused_render(cam_x, cam_y, campos)
         if self._paused:
             self._paused_render(cam_x, cam_y, campos)
 
         if self._unpaused_render != self.loading_render and not self._paused:
-            time_now = time.time()
+            time_now = clock.time()
             del_messageboxes = []
             tsurf = pygame.Surface((self._width, self._height), pygame.SRCALPHA)
             move_up = 0
@@ -1247,20 +1431,36 @@ class Game:
         fps_text = self.font_normal.render(f"FPS: {self.fps:2.1f}", self.AA_text, self.WHITE)
         self._screen.blit(fps_text, (self._width - 80, 5))
 
-        pygame.display.flip()
+        if self._dirty.areas is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update(self._dirty.areas)
 
 
     def cleanup(self):
+        if self._recording is not None:
+            self._recording.close()
         pygame.quit()
 
     def execute(self):
         if self.init_game() == False:
             self._running = False
  
+        tick_time = 1/self._tick_rate
+        lag = 0 # simulated time that is behind the real time
         while(self._running):
             for event in pygame.event.get():
                 self.on_event(event)
-            self.loop()
+
+            """ Run as many fixed ticks as the time since the last frame
+            covers, and draw the game between the last two ticks.
+            """
+            lag = min(lag + self._clock.tick(self._max_fps)/1000, self._max_ticks_per_frame*tick_time)
+            while lag >= tick_time and self._running:
+                self.loop()
+                lag -= tick_time
+            self._interpolation = lag/tick_time
+            self.fps = self._clock.get_fps()
             self.render()
         self.cleanup()
 
@@ -1273,9 +1473,38 @@ class Game:
         alphas = pygame.surfarray.pixels_alpha(surface)
         alphas[alphas != 0] = alpha
 
+    @property
+    def current_map_name(self):
+        return self._current_map_name
+
+    @property
+    def day_time(self):
+        return self._day_time
+
+    @property
+    def drawn_sprites(self):
+        """ Number of sprites and shadows drawn in the last frame """
+        return self._drawn_sprites
+
+    @property
+    def culled_sprites(self):
+        """ Number of sprites and shadows skipped in the last frame because
+        they were outside the camera view
+        """
+        return self._culled_sprites
+
+    @property
+    def projectiles(self):
+        """ The ProjectilePool with the projectiles in flight """
+        return self._projectiles
+
 
 if __name__ == "__main__":
-    game = Game(draw_hitboxes=False, draw_triggers=False)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--record", metavar="FILE", help="record the player input to FILE")
+    parser.add_argument("--replay", metavar="FILE", help="play the input recorded in FILE")
+    args = parser.parse_args()
+    game = Game(draw_hitboxes=False, draw_triggers=False, record_input=args.record, replay_input=args.replay)
     game.execute()
 
 
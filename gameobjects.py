@@ -1,12 +1,81 @@
 import sys
 import os
 import time
+import queue
+import threading
 
 import pygame
 from pygame.locals import *
-from pytmx import load_pygame
 import numpy as np
 
+from tilesets import load_tiled_map
+from collision import SpatialHash, WALL, WATER
+from simclock import clock
+from mapcache import (map_header, map_content_hash, load_baked_map, save_baked_map,
+                      surface_to_buffer, surface_from_buffer)
+
+REGION_SIZE = 16 # width and height in tiles of the map regions that are baked
+                 # together. One region fills one chunk of the map layers.
+STREAMING_MIN_TILES = 500*500 # maps with more tiles than this are streamed
+
+
+def _solid_run_lengths(grid):
+    """ For every cell in a boolean (y, x) grid, count how many consecutive
+    solid cells start there going right and going down (0 for empty cells).
+    """
+    height, width = grid.shape
+    right = np.zeros((height, width + 1), dtype=np.int32)
+    for x in range(width - 1, -1, -1):
+        right[:, x] = (right[:, x + 1] + 1)*grid[:, x]
+    down = np.zeros((height + 1, width), dtype=np.int32)
+    for y in range(height - 1, -1, -1):
+        down[y] = (down[y + 1] + 1)*grid[y]
+    return right[:, :width], down[:height]
+
+
+def _greedy_rects(grid):
+    """ Cover the solid cells of a boolean (y, x) grid with rectangles.
+
+    Cells are visited in row order. From every cell that is not yet covered,
+    the rectangle anchored at that cell which covers the most uncovered cells
+    (ties broken by total area) is picked. Rectangles may overlap.
+    """
+    right, down = _solid_run_lengths(grid)
+    covered = np.zeros_like(grid)
+    rects = []
+    for y, x in np.argwhere(grid).tolist():
+        if covered[y, x]:
+            continue
+        run = right[y, x]
+        heights = np.minimum.accumulate(down[y, x:x + run]) # height of the rect for every width
+        uncovered = ~covered[y:y + heights[0], x:x + run]
+        gained = uncovered.cumsum(0).cumsum(1)[heights - 1, np.arange(run)]
+        areas = heights*np.arange(1, run + 1)
+        best = np.lexsort((areas, gained))[-1]
+        width = int(best) + 1
+        height = int(heights[best])
+        covered[y:y + height, x:x + width] = True
+        rects.append((x, y, width, height))
+    return rects
+
+
+def merge_tile_rects(matrix):
+    """ Decompose the solid tiles of a map matrix into as few rectangles as
+    possible. Both scan orders are tried and the one giving the fewest
+    rectangles is used.
+
+    Arguments:
+    matrix -- boolean Numpy array indexed as [x, y] in tiles, True where the
+              tile is solid.
+
+    Returns:
+    rects -- list of (x, y, width, height) tuples in tiles.
+    """
+    grid = np.asarray(matrix, dtype=bool)
+    row_order = _greedy_rects(grid.T)
+    column_order = [(x, y, width, height) for y, x, height, width in _greedy_rects(grid)]
+    return min(row_order, column_order, key=len)
+
 
 class MessageBox:
     """ Object for displaying info boxes on the screen """
@@ -31,7 +100,7 @@ class MessageBox:
 
         self._text = font.render(text, AA_text, tcolor)
         self._duration = duration
-        self._init_time = time.time()
+        self._init_time = clock.time()
         self._bgcolor = bgcolor
 
         textwidth = self._text.get_width()
@@ -47,7 +116,7 @@ class MessageBox:
         return self._text, self._textpos, self._bgrect, self._bgcolor
 
     def reset_init_time(self):
-        self._init_time = time.time()
+        self._init_time = clock.time()
 
     @property
     def init_time(self):
@@ -58,168 +127,539 @@ class MessageBox:
         return self._duration
 
 
+def collider_hitboxes(collidertype, x, y):
+    """ The hitboxes of one tile on a colliders layer.
+
+    Arguments:
+    collidertype -- the 'type' property of the collider tile.
+    x -- x-position of the tile in pixels.
+    y -- y-position of the tile in pixels.
+
+    Returns:
+    hitboxes -- list of pygame Rects.
+    """
+    hitboxes = []
+    if collidertype == "Top":
+        hitboxes.append(pygame.Rect(x, y, 32, 4))
+    elif collidertype == "Left":
+        hitboxes.append(pygame.Rect(x, y, 4, 32))
+    elif collidertype == "Bottom":
+        hitboxes.append(pygame.Rect(x, y + 28, 32, 4))
+    elif collidertype == "Right":
+        hitboxes.append(pygame.Rect(x + 28, y, 4, 32))
+
+    if collidertype == "TLRM":
+        """ From top left to right middle """
+        hitboxes.append(pygame.Rect(x, y, 16, 8))
+        hitboxes.append(pygame.Rect(x+16, y+8, 16, 8))
+
+    if collidertype == "LMRB":
+        """ From left middle to right bottom """
+        hitboxes.append(pygame.Rect(x, y+12, 8, 8))
+        hitboxes.append(pygame.Rect(x+8, y+16, 12, 8))
+        hitboxes.append(pygame.Rect(x+20, y+24, 12, 8))
+
+    if collidertype == "LMRT":
+        """ From left middle to right top """
+        hitboxes.append(pygame.Rect(x, y+8, 12, 8))
+        hitboxes.append(pygame.Rect(x+12, y, 20, 8))
+
+    if collidertype == "LBRM":
+        """ From left bottom to right middle """
+        hitboxes.append(pygame.Rect(x, y+24, 8, 8))
+        hitboxes.append(pygame.Rect(x+8, y+20, 12, 8))
+        hitboxes.append(pygame.Rect(x+20, y+12, 12, 8))
+
+    if collidertype == "LTRB":
+        """ From left top to right bottom """
+        hitboxes.append(pygame.Rect(x, y, 16, 8))
+        hitboxes.append(pygame.Rect(x+12, y+8, 8, 8))
+        hitboxes.append(pygame.Rect(x+20, y+16, 12, 12))
+
+    if collidertype == "LB":
+        """ Left bottom only """
+        hitboxes.append(pygame.Rect(x, y+24, 8, 8))
+
+    if collidertype == "LBRT":
+        """ From left bottom to right top """
+        hitboxes.append(pygame.Rect(x, y+20, 8, 12))
+        hitboxes.append(pygame.Rect(x+8, y+12, 12, 8))
+        hitboxes.append(pygame.Rect(x+16, y, 16, 12))
+
+    if collidertype == "RB":
+        """ Right bottom only """
+        hitboxes.append(pygame.Rect(x+24, y+24, 8, 8))
+
+    return hitboxes
+
+
+def rle_accelerated(surface):
+    """ Turn on RLE acceleration for a mostly transparent surface, which
+    makes blitting it skip the transparent spans. Returns the surface.
+    """
+    surface.set_alpha(255, pygame.RLEACCEL)
+    return surface
+
+
+def crop_strip(strip, x, y, max_gap = 32):
+    """ Split a row strip of object tiles into runs of non-transparent
+    pixel columns. Runs closer than 'max_gap' pixels are kept together, so
+    each run costs a blit call only when it saves a tile of empty space.
+
+    Arguments:
+    strip -- SRCALPHA surface with the objects of one tile row.
+    x -- x position of the strip on the map.
+    y -- y position of the strip on the map.
+
+    Returns:
+    object_surfs -- list of [surf, x, y] with the cropped, RLE accelerated runs.
+                    Empty if the strip is fully transparent.
+    """
+    columns = pygame.surfarray.pixels_alpha(strip).any(axis=1)
+    filled = np.flatnonzero(columns)
+    if len(filled) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(filled) > max_gap)
+    starts = filled[np.concatenate(([0], breaks + 1))]
+    ends = filled[np.concatenate((breaks, [len(filled) - 1]))] + 1
+    object_surfs = []
+    for start, end in zip(starts, ends):
+        surf = strip.subsurface((int(start), 0, int(end - start), strip.get_height())).copy()
+        object_surfs.append([rle_accelerated(surf), x + int(start), y])
+    return object_surfs
+
+
+def compact_layer_data(tmx_data):
+    """ Replace the tile data of every tile layer, which pytmx stores as nested
+    lists of Python ints, with a (height, width) Numpy array of GIDs.
+    """
+    dtype = np.uint16 if len(tmx_data.images) <= np.iinfo(np.uint16).max else np.uint32
+    for layer in tmx_data.layers:
+        if hasattr(layer, "data"):
+            layer.data = np.array(layer.data, dtype=dtype)
+
+
+def layer_tiles(tmx_data, layer, i_range, j_range, by_column=False):
+    """ Find the tiles of a layer with compacted data within a window.
+
+    Arguments:
+    tmx_data -- the pytmx data of the map.
+    layer -- the tile layer.
+    i_range -- range of tile x positions of the window.
+    j_range -- range of tile y positions of the window.
+
+    Keyword arguments:
+    by_column -- boolean, order the tiles column by column instead of row by
+                 row (default False)
+
+    Returns:
+    i -- array of tile x positions.
+    j -- array of tile y positions.
+    gids -- list of the GIDs of the tiles.
+    """
+    grid = layer.data[j_range.start:j_range.stop, i_range.start:i_range.stop]
+    if by_column:
+        i, j = np.nonzero(grid.T)
+    else:
+        j, i = np.nonzero(grid)
+    return i + i_range.start, j + j_range.start, grid[j, i].tolist()
+
+
+def tile_images(tmx_data, i, j, gids):
+    """ Look up the images of tiles found with 'layer_tiles()', dropping the
+    tiles that have no image.
+
+    Returns:
+    i -- array of tile x positions.
+    j -- array of tile y positions.
+    images -- list of the tile images.
+    """
+    images = [tmx_data.images[gid] for gid in gids]
+    keep = np.array([image is not None for image in images], dtype=bool)
+    if keep.all():
+        return i, j, images
+    return i[keep], j[keep], [image for image in images if image is not None]
+
+
+def draw_strips(strips, i, j, images, origin_x, width):
+    """ Draw object tiles, ordered row by row, on the strip surface of their
+    row. Strips are created as needed, one blits call is made per row.
+
+    Arguments:
+    strips -- dictionary of y position -> strip surface.
+    i -- array of tile x positions.
+    j -- array of tile y positions.
+    images -- list of the tile images.
+    origin_x -- x position of the left edge of the strips in pixels.
+    width -- width of the strips in pixels.
+    """
+    rows, starts = np.unique(j, return_index=True)
+    ends = np.append(starts[1:], len(j))
+    xs = (i*32 - origin_x).tolist()
+    for row, start, end in zip(rows.tolist(), starts.tolist(), ends.tolist()):
+        y = row*32
+        if y not in strips:
+            strips[y] = pygame.Surface((width, 32), pygame.SRCALPHA) # make a surf for this y-position
+        strips[y].blits([(images[n], (xs[n], 0)) for n in range(start, end)], doreturn=False)
+
+
+def bake_region(tmx_data, tiles):
+    """ Bake the tile layers of one region of a Tiled map. Tiles from
+    neighbouring regions that are drawn with a layer offset are clipped to
+    the region, so regions can be baked independently of each other.
+
+    The layer data must be compacted with 'compact_layer_data()'. Each layer
+    is read once as an array, and its tiles are drawn with a single blits call.
+
+    Arguments:
+    tmx_data -- the pytmx data of the map.
+    tiles -- (x, y, width, height) of the region in tiles.
+
+    Returns:
+    baked -- dictionary with the region surfaces (None where nothing was drawn),
+             the cropped [surf, x, y] object strips, the map matrices of the
+             region and the hitboxes from the colliders layers.
+    """
+    i0, j0, width, height = tiles
+    i1 = i0 + width
+    j1 = j0 + height
+    origin_x = i0*32
+    origin_y = j0*32
+    size = (width*32, height*32)
+    inner_i = range(i0, i1)
+    inner_j = range(j0, j1)
+    # tiles one step outside the region can still reach into it through a layer offset
+    outer_i = range(max(i0 - 1, 0), min(i1 + 1, tmx_data.width))
+    outer_j = range(max(j0 - 1, 0), min(j1 + 1, tmx_data.height))
+
+    ground = None
+    bridge = None
+    above = None
+    c_object_surfs = {} # y -> strip surface
+    m_object_surfs = {}
+    water_matrix = np.zeros((width, height), dtype=np.uint8)
+    collision_object_matrix = np.zeros((width, height), dtype=np.uint8)
+    bridge_matrix = np.zeros((width, height), dtype=np.uint8)
+    hitboxes = []
+
+    for layer in tmx_data.layers:
+        if threading.current_thread() is not threading.main_thread():
+            time.sleep(0) # give the main thread the GIL when baking in the background
+        if not hasattr(layer, "data"):
+            continue
+        name = layer.name.lower()
+
+        if "ground" in name or "water" in name:
+            i, j, gids = layer_tiles(tmx_data, layer, inner_i, inner_j, by_column=True)
+            i, j, drawn = tile_images(tmx_data, i, j, gids)
+            if drawn:
+                if ground is None:
+                    ground = pygame.Surface(size)
+                ground.blits(list(zip(drawn, zip((i*32 - origin_x).tolist(), (j*32 - origin_y).tolist()))),
+                             doreturn=False)
+                if "Water" in layer.name:
+                    water_matrix[i - i0, j - j0] = 1
+
+        if "c-objects" in name:
+            """ Collision objects. Draw order is based on y position. """
+            i, j, gids = layer_tiles(tmx_data, layer, inner_i, inner_j)
+            i, j, drawn = tile_images(tmx_data, i, j, gids)
+            draw_strips(c_object_surfs, i, j, drawn, origin_x, size[0])
+            collision_object_matrix[i - i0, j - j0] = 1
+
+        if "m-objects" in name:
+            """ Non-collision objects. Draw order is based on y position. For same y-position
+            M-objects are drawn above C-objects.
+            """
+            i, j, gids = layer_tiles(tmx_data, layer, inner_i, inner_j)
+            i, j, drawn = tile_images(tmx_data, i, j, gids)
+            draw_strips(m_object_surfs, i, j, drawn, origin_x, size[0])
+
+        if "n-objects" in name:
+            """ Non-collision objects. Always draw above C-objects, M-objects and characters. """
+            i, j, gids = layer_tiles(tmx_data, layer, inner_i, inner_j, by_column=True)
+            i, j, drawn = tile_images(tmx_data, i, j, gids)
+            if drawn:
+                if above is None:
+                    above = pygame.Surface(size, pygame.SRCALPHA)
+                above.blits(list(zip(drawn, zip((i*32 - origin_x).tolist(), (j*32 - origin_y).tolist()))),
+                            doreturn=False)
+
+        if "bridges" in name:
+            """ Bridges remove water hitboxes. Always drawn below characters. """
+            offset_y = layer.offsety
+            i, j, gids = layer_tiles(tmx_data, layer, outer_i, outer_j, by_column=True)
+            i, j, drawn = tile_images(tmx_data, i, j, gids)
+            if drawn:
+                if bridge is None:
+                    bridge = pygame.Surface(size, pygame.SRCALPHA)
+                bridge.blits(list(zip(drawn, zip((i*32 - origin_x).tolist(), (j*32 + offset_y - origin_y).tolist()))),
+                             doreturn=False)
+                inside = (i >= i0) & (i < i1) & (j >= j0) & (j < j1)
+                bridge_matrix[i[inside] - i0, j[inside] - j0] = 1
+
+        if "colliders" in name:
+            """ Not drawn """
+            offset_y = layer.offsety
+            offset_x = layer.offsetx
+            i, j, gids = layer_tiles(tmx_data, layer, inner_i, inner_j)
+            for i, j, gid in zip(i.tolist(), j.tolist(), gids):
+                prop = tmx_data.tile_properties.get(gid)
+                if prop is not None:
+                    collidertype = prop["type"]
+                    for l, hitbox in enumerate(collider_hitboxes(collidertype, i*32 + offset_x, j*32 + offset_y)):
+                        hitboxes.append([f"{i}-{j}cmapobj-{collidertype}-{l}", hitbox])
+
+    object_surfs = []
+    for y, surf in c_object_surfs.items():
+        if y in m_object_surfs:
+            surf.blit(m_object_surfs.pop(y), (0, 0))
+        object_surfs.extend(crop_strip(surf, origin_x, y))
+    for y, surf in m_object_surfs.items():
+        object_surfs.extend(crop_strip(surf, origin_x, y))
+
+    if bridge is not None:
+        if ground is None:
+            ground = pygame.Surface(size)
+        ground.blit(bridge, (0, 0))
+
+    return {"tiles": tiles,
+            "ground": ground,
+            "bridge": bridge,
+            "above": above,
+            "object_surfs": object_surfs,
+            "water_matrix": water_matrix,
+            "collision_object_matrix": collision_object_matrix,
+            "bridge_matrix": bridge_matrix,
+            "collider_hitboxes": hitboxes}
+
+
+def _region_worker(tmx_data, requests, results):
+    """ Background thread for streamed maps. Bakes the regions put in the
+    'requests' queue until it gets None.
+    """
+    while True:
+        tiles = requests.get()
+        if tiles is None:
+            return
+        results.put(bake_region(tmx_data, tiles))
+
+
+def surface_bytes(surface):
+    """ Pixel memory of a pygame Surface in bytes. """
+    return surface.get_pitch()*surface.get_height()
+
+
+class ChunkedSurface:
+    """ A map-sized surface stored as a grid of fixed-size chunks. Chunks are
+    only created when something is drawn on them, so empty parts of the map
+    take no memory and are skipped when drawing.
+    """
+    def __init__(self, width, height, flags=0, chunk_size=512):
+        """ Arguments:
+        width -- width of the full surface in pixels.
+        height -- height of the full surface in pixels.
+
+        Keyword arguments:
+        flags -- pygame Surface flags for the chunks, e.g. pygame.SRCALPHA
+                 (default 0)
+        chunk_size -- width and height of each chunk in pixels (default 512)
+        """
+        self._width = width
+        self._height = height
+        self._flags = flags
+        self._chunk_size = chunk_size
+        self._chunks = {} # (chunk column, chunk row) -> Surface
+
+    def chunk_rect(self, key):
+        """ The area of the full surface covered by the chunk at 'key'. """
+        x = key[0]*self._chunk_size
+        y = key[1]*self._chunk_size
+        return pygame.Rect(x, y,
+                           min(self._chunk_size, self._width - x),
+                           min(self._chunk_size, self._height - y))
+
+    def chunk_keys_in_rect(self, rect):
+        """ Keys of all chunk positions that intersect 'rect', whether or not
+        the chunk exists.
+        """
+        rect = rect.clip(pygame.Rect(0, 0, self._width, self._height))
+        if rect.width == 0 or rect.height == 0:
+            return
+        for cy in range(rect.top//self._chunk_size, (rect.bottom - 1)//self._chunk_size + 1):
+            for cx in range(rect.left//self._chunk_size, (rect.right - 1)//self._chunk_size + 1):
+                yield (cx, cy)
+
+    def blit(self, image, pos):
+        """ Draw an image onto the surface at 'pos', creating the chunks it
+        covers if needed.
+        """
+        x, y = int(pos[0]), int(pos[1])
+        key = (x//self._chunk_size, y//self._chunk_size)
+        chunk = self._chunks.get(key)
+        if (chunk is not None and x >= 0 and y >= 0
+                and x%self._chunk_size + image.get_width() <= chunk.get_width()
+                and y%self._chunk_size + image.get_height() <= chunk.get_height()):
+            chunk.blit(image, (x%self._chunk_size, y%self._chunk_size)) # fits in a single existing chunk
+            return
+        image_rect = image.get_rect(topleft = (x, y))
+        for key in self.chunk_keys_in_rect(image_rect):
+            chunk_rect = self.chunk_rect(key)
+            if key not in self._chunks:
+                self._chunks[key] = pygame.Surface(chunk_rect.size, self._flags)
+            self._chunks[key].blit(image, (image_rect.x - chunk_rect.x, image_rect.y - chunk_rect.y))
+
+    def set_chunk(self, key, surface):
+        """ Replace the chunk at 'key' with a surface of the same size. """
+        self._chunks[key] = surface
+
+    def remove_chunk(self, key):
+        """ Drop the chunk at 'key', if it exists. """
+        self._chunks.pop(key, None)
+
+    def draw(self, target, area, dest=(0, 0)):
+        """ Draw the part of the surface inside 'area' onto 'target'. Only the
+        chunks intersecting 'area' are blitted.
+
+        Arguments:
+        target -- the pygame Surface to draw on.
+        area -- pygame Rect, the area of the full surface to draw, e.g. the
+                camera view.
+
+        Keyword arguments:
+        dest -- where the top left corner of 'area' is drawn on 'target'
+                (default (0, 0))
+        """
+        area = pygame.Rect(area)
+        blits = []
+        for key in self.chunk_keys_in_rect(area):
+            chunk = self._chunks.get(key)
+            if chunk is None:
+                continue
+            chunk_rect = self.chunk_rect(key)
+            visible = chunk_rect.clip(area)
+            blits.append((chunk,
+                          (visible.x - area.x + dest[0], visible.y - area.y + dest[1]),
+                          visible.move(-chunk_rect.x, -chunk_rect.y)))
+        target.blits(blits, doreturn=False)
+
+    def bake(self):
+        """ Raw pixel buffers of all the chunks, for the baked map cache. """
+        return {"size": (self._width, self._height),
+                "flags": self._flags,
+                "chunk_size": self._chunk_size,
+                "chunks": {key: surface_to_buffer(chunk) for key, chunk in self._chunks.items()}}
+
+    @classmethod
+    def from_baked(cls, baked):
+        """ Recreate a ChunkedSurface from the data returned by 'bake()'. """
+        chunked = cls(*baked["size"], flags=baked["flags"], chunk_size=baked["chunk_size"])
+        for key, buffer in baked["chunks"].items():
+            chunked._chunks[key] = surface_from_buffer(buffer)
+        return chunked
+
+    @property
+    def chunks(self):
+        return self._chunks
+
+    @property
+    def chunk_size(self):
+        return self._chunk_size
+
+    @property
+    def size(self):
+        return (self._width, self._height)
+
+    @property
+    def byte_size(self):
+        """ Pixel memory of all the chunks in bytes """
+        return sum(surface_bytes(chunk) for chunk in self._chunks.values())
+
+
 class GameMap:
     """ Class for maps. Loads from a Tiled map. """
-    def __init__(self, filename):
-        tmx_data = load_pygame(os.path.join(os.getcwd(), "map", filename))
+    def __init__(self, filename, streaming = None, load_radius = 2, evict_radius = 3):
+        """ Load the map from the baked map cache if it is up to date, otherwise
+        load it from the Tiled map file and store the result in the cache.
+
+        Streamed maps are never fully loaded. Regions of REGION_SIZE x REGION_SIZE
+        tiles are baked around the player in the background, see 'stream_regions()'.
+        Streamed maps do not use the baked map cache.
+
+        Arguments:
+        filename -- filename of the Tiled map in the 'map' folder.
+
+        Keyword arguments:
+        streaming -- whether to stream the map. If None, the map is streamed if
+                     it has a 'streaming' property set in Tiled, or if it has
+                     more than STREAMING_MIN_TILES tiles (default None)
+        load_radius -- when streaming, how many regions around the player's
+                       region to load (default 2)
+        evict_radius -- when streaming, regions further than this many regions
+                        from the player's region are evicted (default 3)
+        """
+        self._filename = filename
+
+        self._stored_npcs = []
+        self._stored_loot = []
+        self._stored_player_position = (0,0)
+        self._stored_camera_positon = (0,0)
+
+        tmx_path = os.path.join(os.getcwd(), "map", filename)
+        if streaming is None:
+            width, height, properties = map_header(tmx_path)
+            if "streaming" in properties:
+                streaming = properties["streaming"] in ("1", "true")
+            else:
+                streaming = width*height > STREAMING_MIN_TILES
+        self._streaming = streaming
+        self._visuals_loaded = True
+        self._revision = 0 # changes whenever the map surfaces change
+        self._load_radius = load_radius
+        self._evict_radius = evict_radius
+
+        if streaming:
+            print(f"Loading map: {filename:>10s} | Streaming")
+            self.load_tmx(filename, load_tiled_map(tmx_path))
+            return
+
+        content_hash = map_content_hash(tmx_path)
+        baked = load_baked_map(filename, content_hash)
+        if baked is not None:
+            print(f"Loading map: {filename:>10s} | From cache")
+            self.load_baked(baked)
+        else:
+            tmx_data = load_tiled_map(tmx_path)
+            self.load_tmx(filename, tmx_data)
+            save_baked_map(filename, content_hash, self.bake())
+
+    def load_tmx(self, filename, tmx_data):
+        """ Set up the map from the pytmx data of a Tiled map. Unless the map is
+        streamed, every region is baked right away.
+        """
         self._mapwidth_tiles = tmx_data.width
         self._mapheight_tiles = tmx_data.height
         self._mapwidth = tmx_data.width*32
         self._mapheight = tmx_data.height*32
-        self._map_layers = tmx_data.layers
         self._outdoors = tmx_data.outdoors
 
-        self._water_matrix = np.zeros((self._mapwidth_tiles, self._mapheight_tiles))
-        self._collision_object_matrix = np.zeros((self._mapwidth_tiles, self._mapheight_tiles))
-        self._bridge_matrix = np.zeros((self._mapwidth_tiles, self._mapheight_tiles))
+        self._water_matrix = np.zeros((self._mapwidth_tiles, self._mapheight_tiles), dtype=np.uint8)
+        self._collision_object_matrix = np.zeros((self._mapwidth_tiles, self._mapheight_tiles), dtype=np.uint8)
+        self._bridge_matrix = np.zeros((self._mapwidth_tiles, self._mapheight_tiles), dtype=np.uint8)
 
-        self._ground_surf = pygame.Surface((self._mapwidth, self._mapheight))
-        self._c_object_surfs = [] # collision objects on the map
-        self._m_object_surfs = {} # non-collision objects on the map (M-objects)
-        self._bridge_surf = pygame.Surface((self._mapwidth, self._mapheight), pygame.SRCALPHA)
-        self._above_surf = pygame.Surface((self._mapwidth, self._mapheight), pygame.SRCALPHA)
+        self._ground_layer = ChunkedSurface(self._mapwidth, self._mapheight, chunk_size=REGION_SIZE*32)
+        self._c_object_surfs = [] # collision and non-collision objects on the map, as [surf, x, y] strips
+        self._bridge_layer = ChunkedSurface(self._mapwidth, self._mapheight, pygame.SRCALPHA, chunk_size=REGION_SIZE*32)
+        self._above_layer = ChunkedSurface(self._mapwidth, self._mapheight, pygame.SRCALPHA, chunk_size=REGION_SIZE*32)
+        self._trigger_definitions = [] # (name, delay, max_num_triggers, rect) for each trigger
         self._triggers = {}
 
         self._collision_hitboxes = []
         self._water_hitboxes = []
+        self._static_hitboxes = SpatialHash()
 
-        self._stored_npcs = []
-        self._stored_loot = []
-        self._stored_player_position = (0,0)
-        self._stored_camera_positon = (0,0)
-
-        self.load_layers(filename, tmx_data)
-
-    def load_layers(self, filename, tmx_data):
-        """ Loop through layers and add appropriate items to the right arrays and lists. """
-        for k, layer in enumerate(self._map_layers):
+        for layer in tmx_data.layers:
             print(f"Loading map: {filename:>10s} | Layer: {layer.name:>25s} | Layertype: {str(layer):>35s}")
-            if ("ground" in layer.name.lower() or "water" in layer.name.lower()):
-                for i in range(self._mapwidth_tiles):
-                    for j in range(self._mapheight_tiles):
-                        x = i*32
-                        y = j*32
-                        image = tmx_data.get_tile_image(i, j, k)
-                        if image is not None:
-                            self._ground_surf.blit(image, (x, y))
-                            if "Water" in layer.name:
-                                self._water_matrix[i, j] = 1
-            
-            if "c-objects" in layer.name.lower():
-                """ Collision objects. Draw order is based on y position. """
-                for j in range(self._mapheight_tiles):
-                    y_surf = pygame.Surface((self._mapwidth, 32), pygame.SRCALPHA) # make a surf for this y-position
-                    y = j*32
-                    for i in range(self._mapwidth_tiles):
-                        image = tmx_data.get_tile_image(i, j, k)
-                        x = i*32
-                        if image is not None:
-                            y_surf.blit(image, (x, 0))
-                            self._collision_object_matrix[i, j] = 1
-                    self._c_object_surfs.append([y_surf, y])
-
-            if "m-objects" in layer.name.lower():
-                """ Non-collision objects. Draw order is based on y position. For same y-position
-                M-objects are drawn above C-objects.
-                """
-                for j in range(self._mapheight_tiles):
-                    y_surf = pygame.Surface((self._mapwidth, 32), pygame.SRCALPHA) # make a surf for this y-position
-                    y = j*32
-                    for i in range(self._mapwidth_tiles):
-                        image = tmx_data.get_tile_image(i, j, k)
-                        x = i*32
-                        if image is not None:
-                            y_surf.blit(image, (x, 0))
-                    self._m_object_surfs[y] = y_surf
-            
-            if "n-objects" in layer.name.lower():
-                """ Non-collision objects. Always draw above C-objects, M-objects and characters. """
-                for i in range(self._mapwidth_tiles):
-                    for j in range(self._mapheight_tiles):
-                        x = i*32
-                        y = j*32
-                        image = tmx_data.get_tile_image(i, j, k)
-                        if image is not None:
-                            self._above_surf.blit(image, (x, y))
-
-            if "bridges" in layer.name.lower():
-                """ Bridges remove water hitboxes. Always drawn below characters. """
-                offset_y = layer.offsety
-                for i in range(self._mapwidth_tiles):
-                    for j in range(self._mapheight_tiles):
-                        x = i*32
-                        y = j*32 + offset_y
-                        image = tmx_data.get_tile_image(i, j, k)
-                        if image is not None:
-                            self._bridge_surf.blit(image, (x, y))
-                            self._bridge_matrix[i, j] = 1
-
-            if "colliders" in layer.name.lower():
-                """ Not drawn """
-                offset_y = layer.offsety
-                offset_x = layer.offsetx
-                for j in range(self._mapheight_tiles):
-                    y = j*32 + offset_y
-                    for i in range(self._mapwidth_tiles):
-                        prop = tmx_data.get_tile_properties(i, j, k)
-                        x = i*32 + offset_x
-                        if prop is not None:
-                            collidertype = prop["type"]
-                            hitboxes = []
-                            if collidertype == "Top":
-                                hitboxes.append(pygame.Rect(x, y, 32, 4))
-                            elif collidertype == "Left":
-                                hitboxes.append(pygame.Rect(x, y, 4, 32))
-                            elif collidertype == "Bottom":
-                                hitboxes.append(pygame.Rect(x, y + 28, 32, 4))
-                            elif collidertype == "Right":
-                                hitboxes.append(pygame.Rect(x + 28, y, 4, 32))
-
-                            if collidertype == "TLRM":
-                                """ From top left to right middle """
-                                hitboxes.append(pygame.Rect(x, y, 16, 8))
-                                hitboxes.append(pygame.Rect(x+16, y+8, 16, 8))
-
-                            if collidertype == "LMRB":
-                                """ From left middle to right bottom """
-                                hitboxes.append(pygame.Rect(x, y+12, 8, 8))
-                                hitboxes.append(pygame.Rect(x+8, y+16, 12, 8))
-                                hitboxes.append(pygame.Rect(x+20, y+24, 12, 8))
-
-                            if collidertype == "LMRT":
-                                """ From left middle to right top """
-                                hitboxes.append(pygame.Rect(x, y+8, 12, 8))
-                                hitboxes.append(pygame.Rect(x+12, y, 20, 8))
-
-                            if collidertype == "LBRM":
-                                """ From left bottom to right middle """
-                                hitboxes.append(pygame.Rect(x, y+24, 8, 8))
-                                hitboxes.append(pygame.Rect(x+8, y+20, 12, 8))
-                                hitboxes.append(pygame.Rect(x+20, y+12, 12, 8))
-
-                            if collidertype == "LTRB":
-                                """ From left top to right bottom """
-                                hitboxes.append(pygame.Rect(x, y, 16, 8))
-                                hitboxes.append(pygame.Rect(x+12, y+8, 8, 8))
-                                hitboxes.append(pygame.Rect(x+20, y+16, 12, 12))
-                            
-                            if collidertype == "LB":
-                                """ Left bottom only """
-                                hitboxes.append(pygame.Rect(x, y+24, 8, 8))
-
-                            if collidertype == "LBRT":
-                                """ From left bottom to right top """
-                                hitboxes.append(pygame.Rect(x, y+20, 8, 12))
-                                hitboxes.append(pygame.Rect(x+8, y+12, 12, 8))
-                                hitboxes.append(pygame.Rect(x+16, y, 16, 12))
-
-                            if collidertype == "RB":
-                                """ Right bottom only """
-                                hitboxes.append(pygame.Rect(x+24, y+24, 8, 8))
-
-                            for l, hitbox in enumerate(hitboxes):
-                                self._collision_hitboxes.append([f"{i}-{j}cmapobj-{collidertype}-{l}", hitbox])
-        
             if "triggers" in layer.name.lower():
                 for item in layer:
                     delay = 20
@@ -228,62 +668,295 @@ class GameMap:
                     max_num_triggers = 0
                     if "max_num_triggers" in item.properties:
                         max_num_triggers = item.properties["max_num_triggers"]
-                    new_trigger = Trigger(item.name, delay = delay, max_num_triggers = max_num_triggers)
-                    self._triggers[new_trigger] = pygame.Rect(item.x, item.y, item.width, item.height)
+                    rect = (item.x, item.y, item.width, item.height)
+                    self._trigger_definitions.append((item.name, delay, max_num_triggers, rect))
+
+        compact_layer_data(tmx_data)
+        if self._streaming:
+            self._region_triggers = {} # region key -> list of (Trigger, rect)
+            for name, delay, max_num_triggers, rect in self._trigger_definitions:
+                key = (int(rect[0])//(REGION_SIZE*32), int(rect[1])//(REGION_SIZE*32))
+                new_trigger = Trigger(name, delay = delay, max_num_triggers = max_num_triggers)
+                self._region_triggers.setdefault(key, []).append((new_trigger, pygame.Rect(rect)))
+            self.start_streaming(tmx_data)
+            return
+
+        for region in self.region_keys():
+            self.add_region(bake_region(tmx_data, self.region_tiles(region)))
 
-        for surf, y in self._c_object_surfs:
-            if y in self._m_object_surfs:
-                m_surf = self._m_object_surfs[y]
-                surf.blit(m_surf, (0, 0))
-                del self._m_object_surfs[y]
+        """ Combine areas where we can use bigger rectangles for hitboxes. """
+        for i, j, width, height in merge_tile_rects(self._collision_object_matrix == 1):
+            hitbox = pygame.Rect(i*32, j*32, width*32, height*32)
+            self._collision_hitboxes.append([f"{i}-{j}cmapobj-comb", hitbox])
 
-        for y, surf in self._m_object_surfs.items():
-            self._c_object_surfs.append([surf, y])
+        water_matrix = (self._water_matrix == 1) & (self._bridge_matrix == 0)
+        """ Combine areas where we can use bigger rectangles for water """
+        for i, j, width, height in merge_tile_rects(water_matrix):
+            hitbox = pygame.Rect(i*32, j*32, width*32, height*32)
+            self._water_hitboxes.append([f"{i}-{j}wmapobj-comb", hitbox])
 
-        self._ground_surf.blit(self._bridge_surf, (0,0))
+        for name, hitbox in self._collision_hitboxes:
+            self._static_hitboxes.insert(name, hitbox, WALL)
+        for name, hitbox in self._water_hitboxes:
+            self._static_hitboxes.insert(name, hitbox, WATER)
 
-        checked_tiles = []
-        """ Combine areas where we can use bigger rectangles for hitboxes. """
-        for i in range(self._mapwidth_tiles):
-            for j in range(self._mapheight_tiles):
-                cur_tile = self._collision_object_matrix[i, j]
-                if (i, j) in checked_tiles:
-                    continue
-                if cur_tile == 1:
-                    combwidth = 1
-                    combheight = 1
-                    comb_size = self.recursive_expand_square(i, j,
-                                                             combwidth,
-                                                             combheight,
-                                                             self._collision_object_matrix)
-                    for ii in range(comb_size[0]):
-                        for jj in range(comb_size[1]):
-                            checked_tiles.append((i + ii, j + jj))
-
-                    hitbox = pygame.Rect(i*32, j*32, comb_size[0]*32, comb_size[1]*32)
-                    self._collision_hitboxes.append([f"{i}-{j}cmapobj-comb", hitbox])
-
-        checked_tiles = []
-        water_matrix = self._water_matrix - self._bridge_matrix
-        """ Combine areas where we can use bigger rectangles for water """
-        for i in range(self._mapwidth_tiles):
-            for j in range(self._mapheight_tiles):
-                cur_tile = water_matrix[i, j]
-                if (i, j) in checked_tiles:
-                    continue
-                if cur_tile == 1:
-                    combwidth = 1
-                    combheight = 1
-                    comb_size = self.recursive_expand_square(i, j,
-                                                             combwidth,
-                                                             combheight,
-                                                             water_matrix)
-                    for ii in range(comb_size[0]):
-                        for jj in range(comb_size[1]):
-                            checked_tiles.append((i + ii, j + jj))
-
-                    hitbox = pygame.Rect(i*32, j*32, comb_size[0]*32, comb_size[1]*32)
-                    self._water_hitboxes.append([f"{i}-{j}wmapobj-comb", hitbox])
+        for name, delay, max_num_triggers, rect in self._trigger_definitions:
+            self._triggers[Trigger(name, delay = delay, max_num_triggers = max_num_triggers)] = pygame.Rect(rect)
+
+    def bake(self):
+        """ Collect everything loaded from the Tiled map into a dictionary of
+        plain data that can be stored in the baked map cache.
+        """
+        return {"mapsize_tiles": (self._mapwidth_tiles, self._mapheight_tiles),
+                "outdoors": self._outdoors,
+                "water_matrix": self._water_matrix,
+                "collision_object_matrix": self._collision_object_matrix,
+                "bridge_matrix": self._bridge_matrix,
+                "ground_layer": self._ground_layer.bake(),
+                "bridge_layer": self._bridge_layer.bake(),
+                "above_layer": self._above_layer.bake(),
+                "object_surfs": [(surface_to_buffer(surf), x, y) for surf, x, y in self._c_object_surfs],
+                "collision_hitboxes": ([name for name, _ in self._collision_hitboxes],
+                                       np.array([tuple(hitbox) for _, hitbox in self._collision_hitboxes])),
+                "water_hitboxes": ([name for name, _ in self._water_hitboxes],
+                                   np.array([tuple(hitbox) for _, hitbox in self._water_hitboxes])),
+                "triggers": self._trigger_definitions}
+
+    def load_baked(self, baked):
+        """ Set up the map from the data returned by 'bake()'. """
+        self._mapwidth_tiles, self._mapheight_tiles = baked["mapsize_tiles"]
+        self._mapwidth = self._mapwidth_tiles*32
+        self._mapheight = self._mapheight_tiles*32
+        self._outdoors = baked["outdoors"]
+
+        self._water_matrix = baked["water_matrix"]
+        self._collision_object_matrix = baked["collision_object_matrix"]
+        self._bridge_matrix = baked["bridge_matrix"]
+
+        self._ground_layer = ChunkedSurface.from_baked(baked["ground_layer"])
+        self._bridge_layer = ChunkedSurface.from_baked(baked["bridge_layer"])
+        self._above_layer = ChunkedSurface.from_baked(baked["above_layer"])
+        self._c_object_surfs = [[rle_accelerated(surface_from_buffer(buffer)), x, y]
+                                for buffer, x, y in baked["object_surfs"]]
+
+        names, rects = baked["collision_hitboxes"]
+        self._collision_hitboxes = [[name, pygame.Rect(rect.tolist())] for name, rect in zip(names, rects)]
+        names, rects = baked["water_hitboxes"]
+        self._water_hitboxes = [[name, pygame.Rect(rect.tolist())] for name, rect in zip(names, rects)]
+        self._static_hitboxes = SpatialHash()
+        for name, hitbox in self._collision_hitboxes:
+            self._static_hitboxes.insert(name, hitbox, WALL)
+        for name, hitbox in self._water_hitboxes:
+            self._static_hitboxes.insert(name, hitbox, WATER)
+
+        self._trigger_definitions = baked["triggers"]
+        self._triggers = {}
+        for name, delay, max_num_triggers, rect in self._trigger_definitions:
+            self._triggers[Trigger(name, delay = delay, max_num_triggers = max_num_triggers)] = pygame.Rect(rect)
+
+    def region_keys(self):
+        """ Keys (column, row) of all the regions of the map. """
+        for ry in range(-(-self._mapheight_tiles//REGION_SIZE)):
+            for rx in range(-(-self._mapwidth_tiles//REGION_SIZE)):
+                yield (rx, ry)
+
+    def region_tiles(self, key):
+        """ The tiles covered by a region, as (x, y, width, height) in tiles. """
+        i = key[0]*REGION_SIZE
+        j = key[1]*REGION_SIZE
+        return (i, j,
+                min(REGION_SIZE, self._mapwidth_tiles - i),
+                min(REGION_SIZE, self._mapheight_tiles - j))
+
+    def add_region(self, baked):
+        """ Add a region returned by 'bake_region()' to the map layers,
+        object strips, map matrices and collider hitboxes.
+        """
+        i, j, width, height = baked["tiles"]
+        key = (i//REGION_SIZE, j//REGION_SIZE)
+        for layer, surf in ((self._ground_layer, baked["ground"]),
+                            (self._bridge_layer, baked["bridge"]),
+                            (self._above_layer, baked["above"])):
+            if surf is not None:
+                layer.set_chunk(key, surf)
+        self._c_object_surfs.extend(baked["object_surfs"])
+        self._water_matrix[i:i + width, j:j + height] = baked["water_matrix"]
+        self._collision_object_matrix[i:i + width, j:j + height] = baked["collision_object_matrix"]
+        self._bridge_matrix[i:i + width, j:j + height] = baked["bridge_matrix"]
+        self._collision_hitboxes.extend(baked["collider_hitboxes"])
+
+    """ Residency """
+    def surface_bytes(self):
+        """ Pixel memory of all the map surfaces in bytes. """
+        return (self._ground_layer.byte_size + self._bridge_layer.byte_size + self._above_layer.byte_size
+                + sum(surface_bytes(surf) for surf, x, y in self._c_object_surfs))
+
+    def unload_visuals(self):
+        """ Free the map surfaces. Gameplay state (stored NPCs, loot and
+        positions, triggers and hitboxes) is kept, and the surfaces are
+        rebuilt with 'reload_visuals()'.
+
+        Streamed maps stop streaming and drop all their regions, including
+        the hitboxes in them, which are streamed in again after reloading.
+        """
+        if not self._visuals_loaded:
+            return
+        if self._streaming:
+            for key in list(self._regions):
+                self.remove_streamed_region(key)
+            self.stop_streaming()
+        else:
+            for layer in (self._ground_layer, self._bridge_layer, self._above_layer):
+                for key in list(layer.chunks):
+                    layer.remove_chunk(key)
+            self._c_object_surfs[:] = []
+        self._visuals_loaded = False
+        self._revision += 1
+
+    def reload_visuals(self):
+        """ Rebuild the surfaces freed by 'unload_visuals()', from the baked map
+        cache if possible.
+        """
+        if self._visuals_loaded:
+            return
+        print(f"Loading map: {self._filename:>10s} | Reloading visuals")
+        if self._streaming:
+            tmx_data = load_tiled_map(os.path.join(os.getcwd(), "map", self._filename))
+            compact_layer_data(tmx_data)
+            self.start_streaming(tmx_data)
+        else:
+            loaded = GameMap(self._filename, streaming = False)
+            for key, chunk in loaded.ground_layer.chunks.items():
+                self._ground_layer.set_chunk(key, chunk)
+            for key, chunk in loaded.bridge_layer.chunks.items():
+                self._bridge_layer.set_chunk(key, chunk)
+            for key, chunk in loaded.above_layer.chunks.items():
+                self._above_layer.set_chunk(key, chunk)
+            self._c_object_surfs[:] = loaded.collision_obj_surfs
+        self._visuals_loaded = True
+        self._revision += 1
+
+    """ Streaming """
+    def start_streaming(self, tmx_data):
+        """ Prepare the map for streaming. Regions are baked by a background
+        thread when requested by 'stream_regions()'.
+        """
+        self._regions = {} # region key -> baked region, for the regions currently loaded
+        self._pending_regions = set()
+        self._region_requests = queue.Queue()
+        self._baked_regions = queue.Queue()
+
+        worker = threading.Thread(target=_region_worker,
+                                  args=(tmx_data, self._region_requests, self._baked_regions),
+                                  daemon=True)
+        worker.start()
+
+    def stop_streaming(self):
+        """ Stop the background thread baking regions for this map. """
+        if self._streaming:
+            self._region_requests.put(None)
+
+    def stream_regions(self, position, wait=False):
+        """ Load the regions around a position and evict the ones far away
+        from it. Does nothing for maps that are not streamed.
+
+        Requested regions are baked in the background and added on a later
+        call. Hitboxes and triggers of loaded regions are added to the map,
+        and removed again when the region is evicted.
+
+        Arguments:
+        position -- (x, y) position to stream around, typically the player.
+
+        Keyword arguments:
+        wait -- if True, block until all regions within the load radius are
+                loaded (default False)
+        """
+        if not self._streaming:
+            return
+        center = (int(position[0])//(REGION_SIZE*32), int(position[1])//(REGION_SIZE*32))
+        distance = lambda key: max(abs(key[0] - center[0]), abs(key[1] - center[1]))
+
+        wanted = []
+        for ry in range(center[1] - self._load_radius, center[1] + self._load_radius + 1):
+            for rx in range(center[0] - self._load_radius, center[0] + self._load_radius + 1):
+                if (0 <= rx*REGION_SIZE < self._mapwidth_tiles
+                        and 0 <= ry*REGION_SIZE < self._mapheight_tiles):
+                    wanted.append((rx, ry))
+        wanted.sort(key=distance)
+
+        for key in wanted:
+            if key not in self._regions and key not in self._pending_regions:
+                self._pending_regions.add(key)
+                self._region_requests.put(self.region_tiles(key))
+
+        for key in [key for key in self._regions if distance(key) > self._evict_radius]:
+            self.remove_streamed_region(key)
+
+        while True:
+            try:
+                baked = self._baked_regions.get(block = wait and not all(key in self._regions for key in wanted))
+            except queue.Empty:
+                break
+            key = (baked["tiles"][0]//REGION_SIZE, baked["tiles"][1]//REGION_SIZE)
+            self._pending_regions.discard(key)
+            if distance(key) <= self._evict_radius:
+                self.add_streamed_region(baked)
+            if not wait and self._baked_regions.empty():
+                break
+
+    def add_streamed_region(self, baked):
+        """ Add a baked region to a streamed map, with its merged hitboxes and
+        triggers.
+        """
+        i, j, width, height = baked["tiles"]
+        key = (i//REGION_SIZE, j//REGION_SIZE)
+        collision_hitboxes = []
+        for ii, jj, w, h in merge_tile_rects(baked["collision_object_matrix"] == 1):
+            hitbox = pygame.Rect((i + ii)*32, (j + jj)*32, w*32, h*32)
+            collision_hitboxes.append([f"{i + ii}-{j + jj}cmapobj-comb", hitbox])
+        water_hitboxes = []
+        water_matrix = (baked["water_matrix"] == 1) & (baked["bridge_matrix"] == 0)
+        for ii, jj, w, h in merge_tile_rects(water_matrix):
+            hitbox = pygame.Rect((i + ii)*32, (j + jj)*32, w*32, h*32)
+            water_hitboxes.append([f"{i + ii}-{j + jj}wmapobj-comb", hitbox])
+
+        baked["collider_hitboxes"] += collision_hitboxes
+        baked["water_hitboxes"] = water_hitboxes
+        self.add_region(baked)
+        self._water_hitboxes.extend(water_hitboxes)
+        for name, hitbox in baked["collider_hitboxes"]:
+            self._static_hitboxes.insert(name, hitbox, WALL)
+        for name, hitbox in water_hitboxes:
+            self._static_hitboxes.insert(name, hitbox, WATER)
+        for trigger, rect in self._region_triggers.get(key, []):
+            if not trigger.disabled:
+                self._triggers[trigger] = rect
+        self._regions[key] = baked
+        self._revision += 1
+
+    def remove_streamed_region(self, key):
+        """ Remove a region from a streamed map, with its hitboxes and triggers. """
+        baked = self._regions.pop(key)
+        i, j, width, height = baked["tiles"]
+        for layer in (self._ground_layer, self._bridge_layer, self._above_layer):
+            layer.remove_chunk(key)
+
+        object_surfs = set(id(surf) for surf, x, y in baked["object_surfs"])
+        self._c_object_surfs[:] = [item for item in self._c_object_surfs if id(item[0]) not in object_surfs]
+        collision_hitboxes = set(id(hitbox) for hitbox in baked["collider_hitboxes"])
+        self._collision_hitboxes[:] = [item for item in self._collision_hitboxes if id(item) not in collision_hitboxes]
+        water_hitboxes = set(id(hitbox) for hitbox in baked["water_hitboxes"])
+        self._water_hitboxes[:] = [item for item in self._water_hitboxes if id(item) not in water_hitboxes]
+        for name, hitbox in baked["collider_hitboxes"] + baked["water_hitboxes"]:
+            self._static_hitboxes.remove(name)
+        for trigger, rect in self._region_triggers.get(key, []):
+            if trigger in self._triggers:
+                del self._triggers[trigger]
+
+        self._water_matrix[i:i + width, j:j + height] = 0
+        self._collision_object_matrix[i:i + width, j:j + height] = 0
+        self._bridge_matrix[i:i + width, j:j + height] = 0
+        self._revision += 1
 
     def store_data(self, npcs, loot, player_position, camera_position):
         """ Stores the current NPCs in the map, player position and camera
@@ -299,39 +972,6 @@ class GameMap:
         return self._stored_npcs, self._stored_loot, np.array(self._stored_player_position), self._stored_camera_positon
 
 
-    def recursive_expand_square(self, x, y, cur_width, cur_height, matrix):
-        """ Expand a square from one point in the matrix into its neighboring
-        points as long all values in the expansion direction is 1.
-        """
-        exp_width = True
-        exp_height = True
-
-        for j in range(cur_height):
-            if x + cur_width < self._mapwidth_tiles:
-                if matrix[x + cur_width, y + j] == 0:
-                    exp_width = False
-            else:
-                exp_width = False
-
-        if exp_width:
-            cur_width += 1
-
-        for i in range(cur_width):
-            if y + cur_height < self._mapheight_tiles:
-                if matrix[x + i, y + cur_height] == 0:
-                    exp_height = False
-            else:
-                exp_height = False
-
-        if exp_height:
-            cur_height += 1
-
-        if exp_width or exp_height:
-            return self.recursive_expand_square(x, y, cur_width, cur_height, matrix)
-        else:
-            return (cur_width, cur_height)
-
-
     @property
     def width(self):
         return self._mapwidth
@@ -353,27 +993,23 @@ class GameMap:
         return self._stored_npcs
 
     @property
-    def ground_surf(self):
-        return self._ground_surf
+    def ground_layer(self):
+        """ Ground and bridges, as a ChunkedSurface """
+        return self._ground_layer
 
     @property
     def collision_obj_surfs(self):
-        """ C-objects surfs """
+        """ C-object and M-object surfs, as cropped [surf, x, y] strips """
         return self._c_object_surfs
 
     @property
-    def non_collison_obj_surfs(self):
-        """ M-objects surfs """
-        return self._m_object_surfs
-
-    @property
-    def bridge_surf(self):
-        return self._bridge_surf
+    def bridge_layer(self):
+        return self._bridge_layer
 
     @property
-    def above_surf(self):
-        """ N-objects surfs """
-        return self._above_surf
+    def above_layer(self):
+        """ N-objects, as a ChunkedSurface """
+        return self._above_layer
 
     @property
     def mapsize(self):
@@ -393,10 +1029,38 @@ class GameMap:
     def water_hitboxes(self):
         return self._water_hitboxes
 
+    @property
+    def static_hitboxes(self):
+        """ Collision and water hitboxes in a SpatialHash, keyed by name """
+        return self._static_hitboxes
+
     @property
     def triggers(self):
         return self._triggers
 
+    @property
+    def trigger_names(self):
+        """ Names of all triggers on the map, including ones in regions that
+        are not streamed in.
+        """
+        return [definition[0] for definition in self._trigger_definitions]
+
+    @property
+    def streaming(self):
+        return self._streaming
+
+    @property
+    def visuals_loaded(self):
+        """ False if the map surfaces were freed with 'unload_visuals()' """
+        return self._visuals_loaded
+
+    @property
+    def revision(self):
+        """ Number that changes whenever regions are streamed in or out, or
+        the map surfaces are unloaded or reloaded.
+        """
+        return self._revision
+
     @property
     def outdoors(self):
         return self._outdoors
@@ -407,14 +1071,14 @@ class Trigger:
         self._name = name
         self._is_triggered = False
         self._delay = delay
-        self._last_triggered = time.time() - delay
+        self._last_triggered = float("-inf") # clock time of the last trigger
         self._max_num_triggers = max_num_triggers
         self._times_triggered = 0
         self._disabled = False
 
     def untrigger(self):
         """ Reset the last triggered timer """
-        self._last_triggered = time.time() - self._delay
+        self._last_triggered = float("-inf")
         self._times_triggered -= 1
         if self._times_triggered < 0:
             self._times_triggered = 0
@@ -423,9 +1087,9 @@ class Trigger:
         return f"Trigger: {self._name}"
 
     def __call__(self):
-        if (time.time() - self._last_triggered > self._delay
+        if (clock.time() - self._last_triggered > self._delay
                 and not self._disabled):
-            self._last_triggered = time.time()
+            self._last_triggered = clock.time()
             self._times_triggered += 1
             if self._times_triggered >= self._max_num_triggers and self._max_num_triggers != 0:
                 self._disabled = True
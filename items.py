@@ -1,10 +1,11 @@
-import time
 import os
 
 import pygame
 from pygame.locals import *
 import numpy as np
 
+from simclock import clock
+
 slm = np.logspace(0.3, -0.8, 20)*0.6 # shadow length modifiers
 
 
@@ -94,6 +95,9 @@ class Projectile:
     can be found in the games image dictionary. E.g.: the arrow can be found in
     Game._images['bow']['WEAPON_arrow'], so the arrow subclass has:
     self.image = ['bow', 'WEAPON_arrow']
+
+    The projectiles in flight are kept in a projectiles.ProjectilePool, which
+    takes the speed, damage and image of each subclass from an instance.
     """
     def __init__(self, x, y, direction, speed, damage):
         self._position = np.array([x, y])
@@ -146,13 +150,13 @@ class Loot:
         self._icon = item.looticon
         self._position = np.array([x, y])
         self._duration = duration
-        self._spawn_time = time.time()
+        self._spawn_time = clock.time()
         self.remove = False # if set to True, the loot will be removed from the
                             # map at first opportunity
 
     def step(self):
         if self._duration > 0:
-            if time.time() - self._spawn_time > self._duration:
+            if clock.time() - self._spawn_time > self._duration:
                 self.remove = True
 
 
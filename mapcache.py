@@ -0,0 +1,115 @@
+import os
+import hashlib
+import pickle
+import xml.etree.ElementTree as ElementTree
+
+import pygame
+
+BAKE_VERSION = 4 # increase when the contents of a baked map change
+CACHE_FOLDER = os.path.join(os.getcwd(), "cache")
+
+
+def map_header(tmx_path):
+    """ Read the size and custom properties of a Tiled map without parsing
+    its layers.
+
+    Returns:
+    width -- map width in tiles.
+    height -- map height in tiles.
+    properties -- dictionary of the map's custom properties.
+    """
+    width = height = None
+    properties = {}
+    for event, element in ElementTree.iterparse(tmx_path, events=("start", "end")):
+        if event == "start" and element.tag == "map":
+            width = int(element.attrib["width"])
+            height = int(element.attrib["height"])
+        elif event == "end" and element.tag == "property" and width is not None:
+            properties[element.attrib["name"]] = element.attrib.get("value")
+        elif event == "end" and element.tag == "properties":
+            break # the map properties come before tilesets and layers
+        elif event == "start" and element.tag in ("tileset", "layer", "objectgroup"):
+            break
+    return width, height, properties
+
+
+def map_source_files(tmx_path):
+    """ Find all files a Tiled map is built from: the map itself, external
+    tilesets and the tileset images.
+
+    Arguments:
+    tmx_path -- path to the .tmx file.
+
+    Returns:
+    files -- list of file paths.
+    """
+    files = [tmx_path]
+    tmx_folder = os.path.dirname(tmx_path)
+    for tileset in ElementTree.parse(tmx_path).getroot().iter("tileset"):
+        tileset_folder = tmx_folder
+        if "source" in tileset.attrib:
+            tsx_path = os.path.join(tmx_folder, tileset.attrib["source"])
+            files.append(tsx_path)
+            tileset = ElementTree.parse(tsx_path).getroot()
+            tileset_folder = os.path.dirname(tsx_path)
+        for image in tileset.iter("image"):
+            files.append(os.path.join(tileset_folder, image.attrib["source"]))
+    return files
+
+
+def map_content_hash(tmx_path):
+    """ Hash of the contents of all the files a map is built from. Changes
+    whenever the map, one of its tilesets or a tileset image is edited.
+    """
+    content_hash = hashlib.sha1(f"bake-{BAKE_VERSION}".encode())
+    for path in map_source_files(tmx_path):
+        content_hash.update(os.path.basename(path).encode())
+        with open(path, "rb") as infile:
+            content_hash.update(infile.read())
+    return content_hash.hexdigest()
+
+
+def load_baked_map(filename, content_hash):
+    """ Load a baked map from the cache.
+
+    Arguments:
+    filename -- filename of the map, e.g. 'map1.tmx'
+    content_hash -- the current map_content_hash of the map.
+
+    Returns:
+    baked -- the baked map data, or None if the map is not in the cache or
+             the cached version is outdated.
+    """
+    path = os.path.join(CACHE_FOLDER, f"{filename}.bake")
+    try:
+        with open(path, "rb") as infile:
+            cached_hash, baked = pickle.load(infile)
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+        return None
+    if cached_hash != content_hash:
+        return None
+    return baked
+
+
+def save_baked_map(filename, content_hash, baked):
+    """ Store a baked map in the cache, replacing any older version. """
+    os.makedirs(CACHE_FOLDER, exist_ok=True)
+    path = os.path.join(CACHE_FOLDER, f"{filename}.bake")
+    with open(path + ".tmp", "wb") as outfile:
+        pickle.dump((content_hash, baked), outfile, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + ".tmp", path)
+
+
+def surface_to_buffer(surface):
+    """ Store the raw pixels of a pygame Surface as (pixels, size, format). """
+    pixel_format = "RGBA" if surface.get_flags() & pygame.SRCALPHA else "RGB"
+    return pygame.image.tostring(surface, pixel_format), surface.get_size(), pixel_format
+
+
+def surface_from_buffer(buffer):
+    """ Recreate a pygame Surface stored with surface_to_buffer. """
+    pixels, size, pixel_format = buffer
+    surface = pygame.image.fromstring(pixels, size, pixel_format)
+    if pixel_format == "RGBA":
+        return surface.convert_alpha()
+    return surface.convert()
@@ -0,0 +1,150 @@
+import queue
+import threading
+from collections import OrderedDict
+
+from gameobjects import GameMap
+
+
+class MapPreloader:
+    """ Builds GameMap objects in a background thread, so that a map is
+    ready by the time the player walks into the trigger leading to it.
+    """
+    def __init__(self, max_maps = 2):
+        """ Start the preloading thread.
+
+        Keyword arguments:
+        max_maps -- the most maps that are preloaded and kept ready at the same
+                    time. Requests beyond this are ignored. 0 disables
+                    preloading (default 2)
+        """
+        self._max_maps = max_maps
+        self._ready = {} # filename -> GameMap
+        self._pending = set()
+        self._lock = threading.Condition()
+        self._requests = queue.Queue()
+        self._worker = threading.Thread(target=self._preload_requested, daemon=True)
+        self._worker.start()
+
+    def _preload_requested(self):
+        while True:
+            filename = self._requests.get()
+            try:
+                game_map = GameMap(filename)
+            except Exception as e:
+                print(f"Preloading map '{filename}' failed: {e}")
+                game_map = None
+            with self._lock:
+                self._pending.discard(filename)
+                if game_map is not None:
+                    self._ready[filename] = game_map
+                self._lock.notify_all()
+
+    def preload(self, filenames):
+        """ Start preloading maps, and drop preloaded maps that are no longer
+        in 'filenames'.
+
+        Arguments:
+        filenames -- iterable of map filenames, in order of priority.
+        """
+        filenames = list(dict.fromkeys(filenames))
+        with self._lock:
+            for filename in list(self._ready):
+                if filename not in filenames:
+                    self._ready.pop(filename).stop_streaming()
+            for filename in filenames:
+                if len(self._ready) + len(self._pending) >= self._max_maps:
+                    break
+                if filename not in self._ready and filename not in self._pending:
+                    self._pending.add(filename)
+                    self._requests.put(filename)
+
+    def take(self, filename):
+        """ Get a preloaded map. If the map is still being built, wait for it.
+
+        Returns:
+        game_map -- the GameMap object, or None if the map was not preloaded.
+        """
+        with self._lock:
+            while filename in self._pending:
+                self._lock.wait()
+            return self._ready.pop(filename, None)
+
+    @property
+    def ready(self):
+        """ Filenames of the maps that are preloaded and ready """
+        with self._lock:
+            return list(self._ready)
+
+
+class MapResidency:
+    """ The maps visited in a game session. When the surfaces of the visited
+    maps take more memory than the budget, the least recently visited maps
+    are reduced to their gameplay state, and their surfaces are rebuilt when
+    they are visited again.
+
+    Supports 'filename in residency', 'residency[filename]' and
+    'residency[filename] = game_map' like a dictionary.
+    """
+    def __init__(self, budget_bytes = 256*2**20):
+        """ Keyword arguments:
+        budget_bytes -- how much memory the map surfaces may take in total.
+                        The current map is always kept (default 256 MB)
+        """
+        self._budget_bytes = budget_bytes
+        self._maps = OrderedDict() # filename -> GameMap, least recently visited first
+
+    def __contains__(self, filename):
+        return filename in self._maps
+
+    def __getitem__(self, filename):
+        return self._maps[filename]
+
+    def __setitem__(self, filename, game_map):
+        self._maps[filename] = game_map
+
+    def visit(self, filename):
+        """ Mark a map as the most recently visited, rebuild its surfaces if
+        they were freed, and free the surfaces of other maps until the budget
+        is met.
+
+        Returns:
+        game_map -- the GameMap object of the visited map.
+        """
+        self._maps.move_to_end(filename)
+        game_map = self._maps[filename]
+        game_map.reload_visuals()
+        self.enforce_budget()
+        return game_map
+
+    def enforce_budget(self):
+        """ Free the surfaces of the least recently visited maps until the
+        total is within the budget. The most recently visited map is kept.
+        """
+        sizes = OrderedDict((filename, game_map.surface_bytes())
+                            for filename, game_map in self._maps.items() if game_map.visuals_loaded)
+        total = sum(sizes.values())
+        for filename, size in list(sizes.items())[:-1]:
+            if total <= self._budget_bytes:
+                break
+            print(f"Unloading map: {filename:>10s} | {size/2**20:.1f} MB")
+            self._maps[filename].unload_visuals()
+            total -= size
+
+    def clear(self):
+        """ Forget all visited maps. """
+        for game_map in self._maps.values():
+            game_map.stop_streaming()
+        self._maps.clear()
+
+    def is_loaded(self, filename):
+        """ Whether a map was visited and still has its surfaces. """
+        return filename in self._maps and self._maps[filename].visuals_loaded
+
+    @property
+    def bytes_used(self):
+        """ Memory of the surfaces of all visited maps in bytes """
+        return sum(game_map.surface_bytes() for game_map in self._maps.values() if game_map.visuals_loaded)
+
+    @property
+    def budget_bytes(self):
+        return self._budget_bytes
@@ -0,0 +1,187 @@
+import pygame
+import numpy as np
+
+ARMING_FRAMES = 5 # projectiles can't hit anything during their first frames,
+                  # so they don't hit the character shooting them
+LIFETIME_FRAMES = 200
+
+""" Unit step of each direction (up, left, down, right), and the hitbox of a
+projectile as (x, y, width, height) relative to its position.
+"""
+DIRECTION_STEPS = np.array([[0, -1], [-1, 0], [0, 1], [1, 0]], dtype=np.float64)
+DIRECTION_HITBOXES = np.array([[-8, -18, 16, 10], [-27, 7, 32, 4], [-8, 8, 16, 10], [-5, 7, 32, 4]], dtype=np.int64)
+
+
+class ProjectilePool:
+    """ All projectiles in flight. The state of each projectile is kept in a
+    slot of preallocated arrays, and the slots of removed projectiles are
+    reused. The sprites of every projectile type are made once, one for each
+    direction.
+
+    Projectile types are the items.Projectile subclasses. An instance made
+    when the type is registered gives the speed, damage and image of the type.
+    """
+    def __init__(self, make_frames, capacity = 64):
+        """ Arguments:
+        make_frames -- function(image) returning the four direction sprites of
+                       a projectile image, as found in Projectile.image.
+
+        Keyword arguments:
+        capacity -- number of slots to allocate at first. The pool grows when
+                    they are used up (default 64)
+        """
+        self._make_frames = make_frames
+        self._type_index = {} # projectile type -> index in self._types
+        self._types = [] # (prototype, frames) for each projectile type
+
+        self._positions = np.zeros((capacity, 2), dtype=np.float64)
+        self._previous_positions = np.zeros((capacity, 2), dtype=np.float64) # before the last step
+        self._velocities = np.zeros((capacity, 2), dtype=np.float64)
+        self._hitboxes = np.zeros((capacity, 4), dtype=np.int64)
+        self._timers = np.zeros(capacity, dtype=np.int64)
+        self._damage = np.zeros(capacity, dtype=np.float64)
+        self._kinds = np.zeros(capacity, dtype=np.int64) # index of the projectile type
+        self._directions = np.zeros(capacity, dtype=np.int64)
+        self._spawned = np.zeros(capacity, dtype=np.int64) # spawn order
+        self._active = np.zeros(capacity, dtype=bool)
+        self._free = list(range(capacity - 1, -1, -1))
+        self._spawn_count = 0
+        self._order = None # active slots in spawn order, made when needed
+
+    def register_type(self, projectile_type):
+        """ Make the sprites of a projectile type. Types are registered on
+        their first spawn otherwise.
+        """
+        if projectile_type in self._type_index:
+            return
+        prototype = projectile_type(0, 0, 0)
+        self._type_index[projectile_type] = len(self._types)
+        self._types.append((prototype, self._make_frames(prototype.image)))
+
+    def spawn(self, projectile_type, x, y, direction):
+        """ Add a projectile.
+
+        Arguments:
+        projectile_type -- the items.Projectile subclass.
+        x, y -- the starting position.
+        direction -- 0, 1, 2 or 3 for up, left, down or right.
+
+        Returns:
+        slot -- the slot of the new projectile.
+        """
+        self.register_type(projectile_type)
+        kind = self._type_index[projectile_type]
+        prototype = self._types[kind][0]
+        if not self._free:
+            self._grow()
+        slot = self._free.pop()
+        self._positions[slot] = x, y
+        self._previous_positions[slot] = x, y
+        self._velocities[slot] = DIRECTION_STEPS[direction]*prototype.speed
+        self._hitboxes[slot] = x, y, 1, 1
+        self._timers[slot] = 0
+        self._damage[slot] = prototype.damage
+        self._kinds[slot] = kind
+        self._directions[slot] = direction
+        self._spawned[slot] = self._spawn_count
+        self._active[slot] = True
+        self._spawn_count += 1
+        self._order = None
+        return slot
+
+    def _grow(self):
+        capacity = len(self._active)
+        for name in ("_positions", "_previous_positions", "_velocities", "_hitboxes", "_timers", "_damage",
+                     "_kinds", "_directions", "_spawned", "_active"):
+            array = getattr(self, name)
+            grown = np.zeros((capacity*2,) + array.shape[1:], dtype=array.dtype)
+            grown[:capacity] = array
+            setattr(self, name, grown)
+        self._free.extend(range(capacity*2 - 1, capacity - 1, -1))
+
+    def step(self):
+        """ Move all projectiles one frame and remove the ones that have
+        existed for too long. The hitbox of a projectile is where it was
+        before the move.
+
+        Returns:
+        armed -- array of the slots of the projectiles that can hit something,
+                 in spawn order.
+        """
+        slots = self.slots()
+        if len(slots) == 0:
+            return slots
+        self._timers[slots] += 1
+        self._hitboxes[slots] = DIRECTION_HITBOXES[self._directions[slots]]
+        self._hitboxes[slots, :2] += self._positions[slots].astype(np.int64)
+        self._previous_positions[slots] = self._positions[slots]
+        self._positions[slots] += self._velocities[slots]
+
+        timers = self._timers[slots]
+        self.remove(slots[timers > LIFETIME_FRAMES])
+        return slots[(timers > ARMING_FRAMES) & (timers <= LIFETIME_FRAMES)]
+
+    def remove(self, slots):
+        """ Remove projectiles. Slots that are already free are ignored. """
+        for slot in np.unique(slots):
+            if self._active[slot]:
+                self._active[slot] = False
+                self._free.append(int(slot))
+                self._order = None
+
+    def clear(self):
+        """ Remove all projectiles. """
+        self.remove(self.slots())
+
+    def slots(self):
+        """ Array of the slots of all projectiles, in spawn order. """
+        if self._order is None:
+            active = np.flatnonzero(self._active)
+            self._order = active[np.argsort(self._spawned[active], kind="stable")]
+        return self._order
+
+    def hitboxes(self, slots = None):
+        """ (N, 4) array of the hitboxes of projectiles, as x, y, width, height.
+
+        Keyword arguments:
+        slots -- the projectiles. None for all, in spawn order (default None)
+        """
+        if slots is None:
+            slots = self.slots()
+        return self._hitboxes[slots]
+
+    def hitbox(self, slot):
+        return pygame.Rect(self._hitboxes[slot].tolist())
+
+    def position(self, slot):
+        return self._positions[slot].copy()
+
+    def damage(self, slot):
+        return float(self._damage[slot])
+
+    def sprites(self, interpolation = 1):
+        """ List of (surface, position) to draw all projectiles, in spawn
+        order. The position is the top left corner of the 64x64 sprite.
+
+        Keyword arguments:
+        interpolation -- where to draw the projectiles between their
+                         positions before (0) and after (1) the last step
+                         (default 1)
+        """
+        slots = self.slots()
+        corners = self._positions[slots] - 32
+        if interpolation != 1:
+            previous = self._previous_positions[slots] - 32
+            corners = previous + (corners - previous)*interpolation
+        return [(self._types[kind][1][direction], corner)
+                for kind, direction, corner in zip(self._kinds[slots], self._directions[slots], corners)]
+
+    def __len__(self):
+        return len(self.slots())
+
+    def __contains__(self, projectile_type):
+        return projectile_type in self._type_index
+
+    @property
+    def capacity(self):
+        return len(self._active)
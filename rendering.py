@@ -0,0 +1,316 @@
+import pygame
+import numpy as np
+
+
+class DirtyRects:
+    """ Keeps track of the parts of the screen that change between frames, so
+    that only those are drawn again and pushed to the display.
+
+    Each frame is described by a view and a list of rects. The view is
+    anything that changes all of the screen when it changes, e.g. the camera
+    position or the map. The rects are the screen areas of the things that
+    can change while the view stays the same, e.g. characters. An area has
+    to be drawn again where something was drawn in the previous frame or is
+    drawn in this one.
+    """
+    def __init__(self, screen_rect, always = (), max_fraction = 0.5, max_rects = 64):
+        """ Arguments:
+        screen_rect -- pygame Rect of the screen.
+
+        Keyword arguments:
+        always -- rects drawn again in every frame, e.g. the FPS counter
+                  (default none)
+        max_fraction -- if the areas to draw cover more than this fraction of
+                        the screen, the whole screen is drawn instead
+                        (default 0.5)
+        max_rects -- if more rects than this changed, the whole screen is
+                     drawn without merging them (default 64)
+        """
+        self._screen_rect = pygame.Rect(screen_rect)
+        self._always = [pygame.Rect(rect) for rect in always]
+        self._max_area = self._screen_rect.width*self._screen_rect.height*max_fraction
+        self._max_rects = max_rects
+        self._view = None
+        self._previous = []
+        self._invalid = True
+        self._areas = None
+
+    def invalidate(self):
+        """ Draw the whole screen in this frame and the next. """
+        self._invalid = True
+
+    def update(self, view, rects):
+        """ Start a new frame.
+
+        Arguments:
+        view -- hashable description of what is on the whole screen.
+        rects -- screen rects of the things that may have changed.
+
+        Returns:
+        areas -- list of pygame Rects to draw, or None to draw the whole screen.
+        """
+        rects = [rect.clip(self._screen_rect) for rect in rects]
+        rects = [rect for rect in rects if rect.width > 0 and rect.height > 0]
+        if self._invalid or view != self._view or len(self._previous) + len(rects) > self._max_rects:
+            areas = None
+        else:
+            areas = merge_rects(self._previous + rects + self._always)
+            if sum(area.width*area.height for area in areas) > self._max_area:
+                areas = None
+        self._view = None if self._invalid else view
+        self._invalid = False
+        self._previous = rects
+        self._areas = areas
+        return areas
+
+    @property
+    def areas(self):
+        """ The areas drawn in the current frame, or None for the whole screen """
+        return self._areas
+
+
+def merge_rects(rects):
+    """ Merge overlapping rects into their bounding rects, until none of the
+    results overlap.
+
+    Arguments:
+    rects -- list of pygame Rects.
+
+    Returns:
+    merged -- list of pygame Rects.
+    """
+    merged = []
+    for rect in rects:
+        rect = pygame.Rect(rect)
+        overlapping = rect.collidelist(merged)
+        while overlapping != -1:
+            rect.union_ip(merged.pop(overlapping))
+            overlapping = rect.collidelist(merged)
+        merged.append(rect)
+    return merged
+
+
+def in_rect(x, y, sizes, rect):
+    """ Which of a set of rectangles overlap a pygame Rect.
+
+    Arguments:
+    x -- (N,) array of the left edges.
+    y -- (N,) array of the top edges.
+    sizes -- (N, 2) array of the widths and heights.
+    rect -- pygame Rect to test against.
+
+    Returns:
+    overlapping -- (N,) boolean array.
+    """
+    return ((x < rect.right) & (x + sizes[:,0] > rect.left)
+            & (y < rect.bottom) & (y + sizes[:,1] > rect.top))
+
+
+class RenderQueue:
+    """ The sprites of a frame in the order they are drawn: sorted by y, so
+    that sprites lower on the map are drawn over the ones above them.
+
+    Static sprites, e.g. the collision object strips of a map, are sorted
+    once when they are set. Each frame only the moving sprites are sorted
+    and merged in between the static sprites in view.
+    """
+    def __init__(self):
+        self._static_key = None
+        self.set_static(None, [], np.zeros((0, 2)), np.zeros(0))
+
+    def set_static(self, key, surfs, positions, sort_y):
+        """ Replace the static sprites.
+
+        Arguments:
+        key -- hashable identifying the static sprites, see 'static_key'.
+        surfs -- list of the sprite Surfaces.
+        positions -- (N, 2) array of where the sprites are drawn on the map.
+        sort_y -- (N,) array of the y-positions the sprites are sorted by.
+        """
+        self._static_key = key
+        order = np.argsort(sort_y, kind="stable")
+        self._static_surfs = np.empty(len(surfs), dtype=object)
+        self._static_surfs[:] = surfs
+        self._static_surfs = self._static_surfs[order]
+        self._static_positions = np.asarray(positions, dtype=float).reshape(-1, 2)[order]
+        self._static_sort_y = np.asarray(sort_y, dtype=float)[order]
+        self._static_sizes = np.array([surf.get_size() for surf in self._static_surfs], dtype=int).reshape(-1, 2)
+        # how far the sprites reach above and below their sort position
+        reach = self._static_positions[:,1] - self._static_sort_y
+        self._reach_up = -min(reach.min(initial=0), 0)
+        self._reach_down = max((reach + self._static_sizes[:,1]).max(initial=0), 0)
+
+    def build(self, view, surfs, positions, sort_y):
+        """ Sort and cull the sprites of a frame.
+
+        Arguments:
+        view -- pygame Rect, sprites not overlapping it are left out.
+        surfs -- list of the moving sprite Surfaces.
+        positions -- (N, 2) array of where the moving sprites are drawn on
+                     the map.
+        sort_y -- (N,) array of the y-positions the moving sprites are sorted by.
+                  They are drawn before static sprites with the same sort_y.
+
+        Returns:
+        surfs -- (M,) object array of the sprites in view, in drawing order.
+        positions -- (M, 2) float array of where they are drawn on the map.
+        sizes -- (M, 2) int array of their sizes.
+        moving -- (M,) boolean array, False for the static sprites.
+        culled -- number of sprites left out.
+        """
+        moving_surfs = np.empty(len(surfs), dtype=object)
+        moving_surfs[:] = surfs
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        sort_y = np.asarray(sort_y, dtype=float)
+        sizes = np.array([surf.get_size() for surf in surfs], dtype=int).reshape(-1, 2)
+        in_view = in_rect(positions[:,0], positions[:,1], sizes, view)
+        order = np.flatnonzero(in_view)[np.argsort(sort_y[in_view], kind="stable")]
+
+        """ Static sprites that can reach into the view, then the ones that do """
+        first = np.searchsorted(self._static_sort_y, view.top - self._reach_down, side="left")
+        last = np.searchsorted(self._static_sort_y, view.bottom + self._reach_up, side="right")
+        static = first + np.flatnonzero(in_rect(self._static_positions[first:last,0], self._static_positions[first:last,1],
+                                                self._static_sizes[first:last], view))
+
+        """ Merge the moving sprites in before the static ones with the same sort_y """
+        slots = np.searchsorted(self._static_sort_y[static], sort_y[order], side="left")
+        moving = np.zeros(len(static) + len(order), dtype=bool)
+        moving[slots + np.arange(len(order))] = True
+
+        merged_surfs = np.empty(len(moving), dtype=object)
+        merged_surfs[moving] = moving_surfs[order]
+        merged_surfs[~moving] = self._static_surfs[static]
+        merged_positions = np.empty((len(moving), 2))
+        merged_positions[moving] = positions[order]
+        merged_positions[~moving] = self._static_positions[static]
+        merged_sizes = np.empty((len(moving), 2), dtype=int)
+        merged_sizes[moving] = sizes[order]
+        merged_sizes[~moving] = self._static_sizes[static]
+        culled = len(surfs) + len(self._static_surfs) - len(moving)
+        return merged_surfs, merged_positions, merged_sizes, moving, culled
+
+    @property
+    def static_key(self):
+        """ The key the static sprites were set with """
+        return self._static_key
+
+
+class GroundBuffer:
+    """ The ground of the map under the camera, kept from frame to frame.
+
+    When the camera moves, the buffer is scrolled by the same amount and
+    only the strips that came into view are drawn from the map, instead of
+    drawing all of the view again.
+    """
+    def __init__(self, size, max_jump = 0.5):
+        """ Arguments:
+        size -- width and height of the view in pixels.
+
+        Keyword arguments:
+        max_jump -- if the camera moved more than this fraction of the view,
+                    all of the buffer is drawn again (default 0.5)
+        """
+        self._surface = pygame.Surface(size)
+        self._max_jump = (size[0]*max_jump, size[1]*max_jump)
+        self._key = None
+        self._camera = None
+        self._drawn_area = 0
+
+    def invalidate(self):
+        """ Draw all of the buffer again in the next update. """
+        self._key = None
+
+    def update(self, layer, camera_rect, key):
+        """ Bring the buffer up to date with the camera.
+
+        Arguments:
+        layer -- the ChunkedSurface the ground is drawn from.
+        camera_rect -- pygame Rect, the area of the map in view.
+        key -- hashable identifying what is on the layer, e.g. the map and
+               its revision. When it changes, all of the buffer is drawn again.
+
+        Returns:
+        surface -- the view-sized Surface with the ground on it.
+        """
+        view = self._surface.get_rect()
+        if key != self._key:
+            self._draw(layer, camera_rect, [view])
+        else:
+            dx = camera_rect.x - self._camera[0]
+            dy = camera_rect.y - self._camera[1]
+            if abs(dx) > self._max_jump[0] or abs(dy) > self._max_jump[1]:
+                self._draw(layer, camera_rect, [view])
+            elif dx or dy:
+                self._surface.scroll(-dx, -dy)
+                exposed = []
+                if dx:
+                    exposed.append(pygame.Rect(view.width - dx if dx > 0 else 0, 0, abs(dx), view.height))
+                if dy:
+                    exposed.append(pygame.Rect(0, view.height - dy if dy > 0 else 0, view.width, abs(dy)))
+                self._draw(layer, camera_rect, exposed)
+            else:
+                self._drawn_area = 0
+        self._key = key
+        self._camera = camera_rect.topleft
+        return self._surface
+
+    def _draw(self, layer, camera_rect, rects):
+        """ Draw the ground inside 'rects' of the buffer from the layer. """
+        self._drawn_area = 0
+        for rect in rects:
+            self._surface.fill((0, 0, 0), rect)
+            layer.draw(self._surface, rect.move(camera_rect.topleft), rect.topleft)
+            self._drawn_area += rect.width*rect.height
+
+    @property
+    def surface(self):
+        return self._surface
+
+    @property
+    def drawn_area(self):
+        """ Pixels drawn from the map in the last update """
+        return self._drawn_area
+
+
+class NightOverlay:
+    """ The darkness drawn over outdoor maps in the evening and at night.
+
+    One screen-sized surface is filled once and kept. Its opacity is only
+    set again when it changes by a whole step, which happens every minute
+    or so of game time, and nothing is drawn during the day.
+    """
+    def __init__(self, size, color = (0, 0, 0)):
+        """ Arguments:
+        size -- width and height of the screen in pixels.
+
+        Keyword arguments:
+        color -- color of the darkness (default black)
+        """
+        self._surface = pygame.Surface(size, pygame.HWSURFACE)
+        self._surface.fill(color)
+        self._alpha = None
+
+    def update(self, alpha):
+        """ Set the opacity of the darkness.
+
+        Arguments:
+        alpha -- opacity from 0 to 255, or None during the day. Fractions
+                 are dropped, as pygame does.
+
+        Returns:
+        surface -- the Surface to draw over the screen, or None if there is
+                   nothing to draw.
+        """
+        if alpha is not None:
+            alpha = int(alpha)
+            if alpha <= 0:
+                alpha = None
+        if alpha is not None and alpha != self._alpha:
+            self._surface.set_alpha(alpha)
+        self._alpha = alpha
+        return None if alpha is None else self._surface
+
+    @property
+    def alpha(self):
+        """ The opacity set in the last update, or None """
+        return self._alpha
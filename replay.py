@@ -0,0 +1,119 @@
+""" Recording and replaying of the player input, one entry per simulation
+tick. Replaying a recording plays the same game again, since all timers in
+the game run on the simulation clock.
+
+File format, little endian:
+header -- b"RPGI", format version (uint8), ticks per second (uint16)
+runs -- repeated (number of ticks (uint16), pressed keys (uint8)), where bit n
+        of the pressed keys is set if RECORDED_KEYS[n] is held down.
+"""
+import struct
+
+import pygame
+
+MAGIC = b"RPGI"
+VERSION = 1
+HEADER = struct.Struct("<4sBH")
+RUN = struct.Struct("<HB")
+RECORDED_KEYS = (pygame.K_w, pygame.K_a, pygame.K_s, pygame.K_d, pygame.K_SPACE, pygame.K_LSHIFT)
+
+
+def key_mask(key_states):
+    """ The recorded keys held down as a bit mask.
+
+    Arguments:
+    key_states -- the keys held down, indexed by pygame key constants.
+    """
+    mask = 0
+    for bit, key in enumerate(RECORDED_KEYS):
+        if key_states[key]:
+            mask |= 1 << bit
+    return mask
+
+
+class RecordedKeys:
+    """ The keys held down in a recorded tick, in the form of
+    pygame.key.get_pressed().
+    """
+    def __init__(self, mask):
+        self._mask = mask
+
+    def __getitem__(self, key):
+        if key not in RECORDED_KEYS:
+            return False
+        return bool(self._mask >> RECORDED_KEYS.index(key) & 1)
+
+
+class InputRecording:
+    """ Writes the input of every tick to a file. Ticks with the same input
+    in a row are stored as one run.
+    """
+    def __init__(self, filename, tick_rate):
+        """ Arguments:
+        filename -- path of the file to write.
+        tick_rate -- simulation ticks per second of the game.
+        """
+        self._file = open(filename, "wb")
+        self._file.write(HEADER.pack(MAGIC, VERSION, tick_rate))
+        self._mask = None
+        self._count = 0
+
+    def record(self, key_states):
+        """ Add the input of one tick. """
+        mask = key_mask(key_states)
+        if mask != self._mask or self._count == 0xFFFF:
+            self._write_run()
+            self._mask = mask
+        self._count += 1
+
+    def _write_run(self):
+        if self._count > 0:
+            self._file.write(RUN.pack(self._count, self._mask))
+        self._count = 0
+
+    def close(self):
+        """ Write the last run and close the file. """
+        if not self._file.closed:
+            self._write_run()
+            self._file.close()
+
+
+class InputReplay:
+    """ Reads a recording made with InputRecording, one tick at a time. """
+    def __init__(self, filename):
+        """ Arguments:
+        filename -- path of the recording.
+        """
+        with open(filename, "rb") as infile:
+            data = infile.read()
+        magic, version, self._tick_rate = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"'{filename}' is not an input recording of version {VERSION}")
+        self._runs = list(RUN.iter_unpack(data[HEADER.size:]))
+        self._run = 0
+        self._tick_in_run = 0
+
+    def next(self):
+        """ The input of the next tick.
+
+        Returns:
+        key_states -- RecordedKeys, or None when the recording has ended.
+        """
+        if self._run == len(self._runs):
+            return None
+        count, mask = self._runs[self._run]
+        self._tick_in_run += 1
+        if self._tick_in_run == count:
+            self._run += 1
+            self._tick_in_run = 0
+        return RecordedKeys(mask)
+
+    @property
+    def tick_rate(self):
+        """ Simulation ticks per second of the recorded game """
+        return self._tick_rate
+
+    @property
+    def ticks(self):
+        """ Number of ticks in the recording """
+        return sum(count for count, mask in self._runs)
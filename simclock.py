@@ -0,0 +1,34 @@
+class SimulationClock:
+    """ The time of the game world. It only moves forward when the game
+    simulates a tick, by the length of a tick, so timers in the game behave
+    the same whether the game runs in real time, slower, faster or paused.
+    """
+    def __init__(self):
+        self._ticks = 0
+        self._tick_time = 1/30
+
+    def advance(self):
+        """ Move forward by one tick. """
+        self._ticks += 1
+
+    def reset(self, tick_time = None):
+        """ Go back to time 0.
+
+        Keyword arguments:
+        tick_time -- the length of a tick in seconds. None to keep the current
+                     length (default None, starting at 1/30)
+        """
+        self._ticks = 0
+        if tick_time is not None:
+            self._tick_time = tick_time
+
+    def time(self):
+        """ Seconds since the clock was reset """
+        return self._ticks*self._tick_time
+
+    @property
+    def ticks(self):
+        return self._ticks
+
+
+clock = SimulationClock() # the clock of the game, shared by all its timers
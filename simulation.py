@@ -0,0 +1,134 @@
+""" Runs the game without a window, a tick at a time, for simulating AI
+behaviour and balancing combat in batches.
+
+Example:
+    simulation = Simulation()
+    observation = simulation.reset()
+    for tick in range(300):
+        observation = simulation.step(["right", "attack"])
+
+Every simulation runs in its own process, since pygame has one display per
+process. 'run_episode()' is meant for process pools:
+
+    with ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn")) as pool:
+        results = list(pool.map(run_episode, scripts))
+"""
+import pygame
+import numpy as np
+
+from game import Game
+
+""" The keys pressed for each action """
+ACTIONS = {"up": pygame.K_w,
+           "left": pygame.K_a,
+           "down": pygame.K_s,
+           "right": pygame.K_d,
+           "attack": pygame.K_SPACE,
+           "run": pygame.K_LSHIFT}
+
+
+class KeyStates:
+    """ Pressed keys in the form of pygame.key.get_pressed(), made from a
+    list of action names.
+    """
+    def __init__(self, actions):
+        self._keys = set(ACTIONS[action] for action in actions)
+
+    def __getitem__(self, key):
+        return key in self._keys
+
+
+class Simulation:
+    """ A headless game, stepped one simulation tick at a time. """
+    def __init__(self, **game_arguments):
+        """ Load the game without a window or audio.
+
+        Keyword arguments are passed on to Game, e.g. 'preload_maps = 0'.
+        """
+        self._game = Game(headless = True, **game_arguments)
+        self._game.init_game()
+        self._ticks = 0
+
+    def reset(self):
+        """ Start the game from the beginning.
+
+        Returns:
+        observation -- see 'observe()'.
+        """
+        self._game.new_game()
+        self._ticks = 0
+        return self.observe()
+
+    def step(self, actions = ()):
+        """ Run one simulation tick.
+
+        Keyword arguments:
+        actions -- iterable of the actions of the player in this tick, out of
+                   "up", "left", "down", "right", "attack" and "run"
+                   (default none)
+
+        Returns:
+        observation -- see 'observe()'.
+        """
+        self._game.loop(KeyStates(actions))
+        self._ticks += 1
+        return self.observe()
+
+    def observe(self):
+        """ The state of the game.
+
+        Returns:
+        observation -- dictionary with
+            "tick": simulation ticks since the last reset,
+            "map": filename of the current map,
+            "day_time": time of day, from 0 to 400,
+            "player": dictionary of "position", "health" and "stamina",
+            "npcs": list of dictionaries of "id", "position" and "health",
+            "projectiles": (N, 2) array of the projectile positions,
+            "done": whether the player is dead.
+        """
+        game = self._game
+        player = game.player
+        projectiles = game.projectiles
+        return {"tick": self._ticks,
+                "map": game.current_map_name,
+                "day_time": game.day_time,
+                "player": {"position": player.position.copy(),
+                           "health": player.health,
+                           "stamina": player.stamina},
+                "npcs": [{"id": npc.id, "position": np.array(npc.position, dtype=float), "health": npc.health}
+                         for npc in game.npcs],
+                "projectiles": np.array([projectiles.position(slot) for slot in projectiles.slots()]).reshape(-1, 2),
+                "done": player.health <= 0}
+
+    @property
+    def game(self):
+        """ The Game object, e.g. for adding NPCs or items """
+        return self._game
+
+
+_simulation = None # the simulation of this process, reused by run_episode
+
+
+def run_episode(actions, **game_arguments):
+    """ Reset the simulation of this process and step it through a list of
+    actions. The game is only loaded on the first call in a process.
+
+    Arguments:
+    actions -- list with the actions of each tick, see 'Simulation.step()'.
+
+    Keyword arguments are passed on to Game on the first call.
+
+    Returns:
+    observations -- list with the observation after each tick.
+    """
+    global _simulation
+    if _simulation is None:
+        _simulation = Simulation(**game_arguments)
+    _simulation.reset()
+    observations = []
+    for tick_actions in actions:
+        observations.append(_simulation.step(tick_actions))
+        if observations[-1]["done"]:
+            break
+    return observations
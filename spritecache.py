@@ -0,0 +1,69 @@
+from collections import OrderedDict
+
+
+class FrameCache:
+    """ Bounded cache of sprite frames, shared by all characters. Characters
+    wearing the same things in the same pose get the same Surface, so frames
+    taken from the cache must not be drawn on.
+
+    When the cache is full, the least recently used frame is dropped.
+    """
+    def __init__(self, max_frames = 2048):
+        """ Keyword arguments:
+        max_frames -- the most frames kept at the same time. A 64x64 frame takes
+                      16 kB (default 2048)
+        """
+        self._max_frames = max_frames
+        self._frames = OrderedDict() # key -> Surface, least recently used first
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key, make_frame):
+        """ Find a frame in the cache, or make and add it if it is missing.
+
+        Arguments:
+        key -- hashable key identifying the frame, e.g. the layer Surfaces and
+               the animation frame they are cut from.
+        make_frame -- function without arguments returning the frame Surface,
+                      called on a miss.
+
+        Returns:
+        frame -- the cached Surface.
+        """
+        frame = self._frames.get(key)
+        if frame is not None:
+            self._frames.move_to_end(key)
+            self._hits += 1
+            return frame
+        self._misses += 1
+        frame = make_frame()
+        self._frames[key] = frame
+        while len(self._frames) > self._max_frames:
+            self._frames.popitem(last=False)
+        return frame
+
+    def clear(self):
+        """ Drop all frames and reset the counters. """
+        self._frames.clear()
+        self._hits = 0
+        self._misses = 0
+
+    def __len__(self):
+        return len(self._frames)
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+    @property
+    def max_frames(self):
+        return self._max_frames
+
+
+frame_cache = FrameCache() # composited character frames
+shadow_cache = FrameCache() # shadows of the frames at each time of day
+atlas_cache = FrameCache(64) # merged animation sheets, up to 1 MB each
@@ -0,0 +1,118 @@
+import threading
+
+import pygame
+import pytmx
+from pytmx.util_pygame import handle_transformation, smart_convert
+
+_tileset_images = {} # path -> TilesetImage
+_lock = threading.Lock()
+
+
+class TilesetImage:
+    """ A tileset image, decoded once and converted to the display format.
+    Tiles are handed out as subsurfaces, so every map using the tileset
+    shares the same pixels.
+    """
+    def __init__(self, path):
+        """ Arguments:
+        path -- path to the tileset image file.
+        """
+        self._image = pygame.image.load(path)
+        self._opaque = None
+        self._alpha = None
+        self._tiles = {} # (rect, flags, colorkey, pixelalpha) -> tile surface
+
+    def tile(self, rect=None, flags=None, colorkey=None, pixelalpha=True):
+        """ Get a tile, converted the same way as pytmx' smart_convert: tiles
+        without transparent pixels have no per-pixel alpha.
+
+        Keyword arguments:
+        rect -- (x, y, width, height) of the tile in the image. None for the
+                whole image (default None)
+        flags -- pytmx TileFlags for flipped or rotated tiles (default None)
+        colorkey -- pygame Color of the tileset colorkey (default None)
+        pixelalpha -- whether tiles with transparent pixels use per-pixel
+                      alpha (default True)
+
+        Returns:
+        tile -- the tile surface, shared with every other caller.
+        """
+        if rect is None:
+            rect = self._image.get_rect()
+        key = (tuple(rect), flags, None if colorkey is None else tuple(colorkey), pixelalpha)
+        tile = self._tiles.get(key)
+        if tile is not None:
+            return tile
+
+        if flags:
+            """ Transformed tiles are not shared with the tileset pixels """
+            tile = handle_transformation(self._image.subsurface(rect), flags)
+            tile = smart_convert(tile, colorkey, pixelalpha)
+        elif colorkey:
+            tile = self.opaque.subsurface(rect).copy()
+            tile.set_colorkey(colorkey, pygame.RLEACCEL)
+        else:
+            original = self._image.subsurface(rect)
+            opaque_pixels = pygame.mask.from_surface(original, 254).count()
+            if opaque_pixels == rect[2]*rect[3] or not pixelalpha:
+                tile = self.opaque.subsurface(rect)
+            else:
+                tile = self.alpha.subsurface(rect)
+        self._tiles[key] = tile
+        return tile
+
+    @property
+    def opaque(self):
+        """ The tileset converted to the display format without alpha """
+        if self._opaque is None:
+            self._opaque = self._image.convert()
+        return self._opaque
+
+    @property
+    def alpha(self):
+        """ The tileset converted to the display format with per-pixel alpha """
+        if self._alpha is None:
+            self._alpha = self._image.convert_alpha()
+        return self._alpha
+
+
+def tileset_image(path):
+    """ Get the shared TilesetImage of an image file, loading it if needed. """
+    with _lock:
+        image = _tileset_images.get(path)
+        if image is None:
+            image = TilesetImage(path)
+            _tileset_images[path] = image
+        return image
+
+
+def shared_image_loader(filename, colorkey, **kwargs):
+    """ pytmx image loader that uses the shared tileset cache instead of
+    loading the image again for every map.
+    """
+    if colorkey:
+        colorkey = pygame.Color("#{0}".format(colorkey))
+    pixelalpha = kwargs.get("pixelalpha", True)
+    image = tileset_image(filename)
+
+    def load_image(rect=None, flags=None):
+        with _lock:
+            return image.tile(rect, flags, colorkey, pixelalpha)
+
+    return load_image
+
+
+def load_tiled_map(tmx_path):
+    """ Load a Tiled map with pytmx, with the tile images taken from the
+    shared tileset cache.
+
+    Returns:
+    tmx_data -- the pytmx TiledMap.
+    """
+    return pytmx.TiledMap(tmx_path, image_loader=shared_image_loader)
+
+
+def clear_tileset_cache():
+    """ Forget all loaded tileset images. """
+    with _lock:
+        _tileset_images.clear()
@@ -62,6 +62,22 @@ class TriggerScript:
 
 triggerscripts = {}
 
+def change_map_targets(trigger_names):
+    """ Find the maps that the given triggers lead to.
+
+    Arguments:
+    trigger_names -- iterable of trigger names.
+
+    Returns:
+    map_names -- list of map filenames, without duplicates, in trigger order.
+    """
+    map_names = []
+    for name in trigger_names:
+        script = triggerscripts.get(name)
+        if script is not None and script.setmap is not None and script.setmap[0] not in map_names:
+            map_names.append(script.setmap[0])
+    return map_names
+
 def new_script(name, movement_req = None):
     script = TriggerScript(name, movement_req)
     triggerscripts[name] = script